@@ -13,13 +13,14 @@ def _init_once():
     global _initialized
     if not _initialized:
         utils.init_db()
-        try:
-            utils.init_mem_db()
-        except Exception:
-            pass
         _initialized = True
 
 
+@app.teardown_appcontext
+def _release_db(exc):
+    utils.release_db()
+
+
 # 注册蓝图
 app.register_blueprint(bp)
 
@@ -0,0 +1,88 @@
+"""
+章节读取基准：整本解码后切片 vs. 按字节偏移 mmap 只解码一章
+
+用法: python bench_chapter_read.py [--size-mb 50] [--reads 200]
+会在临时目录生成一个 GB18030 编码的测试小说，跑完自动删除。
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import utils
+
+
+def make_novel(path: Path, size_mb: int):
+    para = '他抬头望向远处的群山，心中默默想着接下来该怎么走。风从山谷里吹来，带着些许凉意。\n'
+    chunks = []
+    total = 0
+    idx = 0
+    target = size_mb * 1024 * 1024
+    while total < target:
+        idx += 1
+        chapter = f'第{idx}章 山雨欲来\n' + para * random.randint(40, 120)
+        data = chapter.encode('gb18030')
+        chunks.append(data)
+        total += len(data)
+    path.write_bytes(b''.join(chunks))
+    return idx
+
+
+def measure(fn, reads):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for _ in range(reads):
+        fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / reads, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size-mb', type=int, default=50)
+    ap.add_argument('--reads', type=int, default=200, help='mmap 路径的随机读取次数')
+    ap.add_argument('--full-reads', type=int, default=1, help='整本读取路径的次数（很慢）')
+    args = ap.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    try:
+        path = tmp / 'bench_gb18030.txt'
+        n = make_novel(path, args.size_mb)
+        print(f'测试文件: {path.stat().st_size / 1024 / 1024:.1f} MB, {n} 章, GB18030')
+
+        text = path.read_bytes().decode('gb18030')
+        chapters = utils.add_byte_offsets(text, utils.extract_chapters(text), 'gb18030')
+        del text
+        picks = [random.choice(chapters) for _ in range(max(args.reads, args.full_reads))]
+        it_full = iter(picks)
+        it_mmap = iter(picks)
+
+        def full_read():
+            c = next(it_full)
+            return utils.read_text_with_encoding(path)[c['start']:c['end']]
+
+        def mmap_read():
+            c = next(it_mmap)
+            return utils.read_byte_range(path, c['byte_start'], c['byte_end'], 'gb18030')
+
+        c = chapters[len(chapters) // 2]
+        assert utils.read_text_with_encoding(path)[c['start']:c['end']] == \
+            utils.read_byte_range(path, c['byte_start'], c['byte_end'], 'gb18030')
+
+        full_t, full_mem = measure(full_read, args.full_reads)
+        mmap_t, mmap_mem = measure(mmap_read, args.reads)
+        print(f'{"路径":<16}{"每次耗时":>14}{"峰值内存":>14}')
+        print(f'{"整本解码+切片":<12}{full_t * 1000:>14.2f}ms{full_mem / 1024 / 1024:>12.2f}MB')
+        print(f'{"mmap 字节区间":<12}{mmap_t * 1000:>14.2f}ms{mmap_mem / 1024 / 1024:>12.2f}MB')
+        print(f'加速: {full_t / mmap_t:.0f}x')
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
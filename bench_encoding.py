@@ -0,0 +1,91 @@
+"""
+编码检测基准：旧的“UTF-8 失败就对全文跑 chardet” vs. 样本检测 + 快速路径
+
+用法: python bench_encoding.py [--files-per-encoding 5] [--size-mb 2]
+在临时目录生成 UTF-8 / GBK / GB18030 / Big5 / UTF-16 混合语料，跑完自动删除。
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import chardet
+
+import utils
+
+SIMPLIFIED = '他抬头望向远处的群山，心中默默想着接下来该怎么走。风从山谷里吹来，带着些许凉意。\n'
+TRADITIONAL = '他抬頭望向遠處的群山，心中默默想著接下來該怎麼走。風從山谷裡吹來，帶著些許涼意。\n'
+ENCODINGS = ['utf-8', 'gbk', 'gb18030', 'big5', 'utf-16']
+
+
+def old_read_text_with_encoding(file_path: Path) -> str:
+    # 旧实现：UTF-8 失败后对整个文件跑 chardet
+    try:
+        return file_path.read_text(encoding='utf-8')
+    except Exception:
+        raw = file_path.read_bytes()
+        info = chardet.detect(raw)
+        enc = info.get('encoding') or 'utf-8'
+        try:
+            return raw.decode(enc, errors='ignore')
+        except Exception:
+            return raw.decode('utf-8', errors='ignore')
+
+
+def make_corpus(root: Path, per_encoding: int, size_mb: float):
+    files = []
+    for enc in ENCODINGS:
+        para = TRADITIONAL if enc == 'big5' else SIMPLIFIED
+        for i in range(per_encoding):
+            parts = []
+            n = 0
+            idx = 0
+            while n < size_mb * 1024 * 1024:
+                idx += 1
+                title = '山雨欲來' if enc == 'big5' else '山雨欲来'
+                chunk = f'第{idx}章 {title}\n' + para * random.randint(20, 60)
+                parts.append(chunk)
+                n += len(chunk) * 2
+            p = root / f'{enc}_{i}.txt'
+            p.write_bytes(''.join(parts).encode(enc))
+            files.append((enc, p))
+    return files
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--files-per-encoding', type=int, default=5)
+    ap.add_argument('--size-mb', type=float, default=2)
+    args = ap.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    try:
+        files = make_corpus(tmp, args.files_per_encoding, args.size_mb)
+        total_mb = sum(p.stat().st_size for _, p in files) / 1024 / 1024
+        print(f'语料: {len(files)} 个文件, {total_mb:.1f} MB')
+        print(f'{"编码":<10}{"旧实现":>12}{"新实现":>12}{"检测结果":>12}')
+        old_total = new_total = 0.0
+        for enc in ENCODINGS:
+            group = [p for e, p in files if e == enc]
+            t0 = time.perf_counter()
+            for p in group:
+                old_read_text_with_encoding(p)
+            old_t = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            detected = set()
+            for p in group:
+                _, d = utils.read_text_and_encoding(p)
+                detected.add(d)
+            new_t = time.perf_counter() - t0
+            old_total += old_t
+            new_total += new_t
+            print(f'{enc:<10}{old_t / len(group) * 1000:>10.1f}ms{new_t / len(group) * 1000:>10.1f}ms{",".join(sorted(detected)):>12}')
+        print(f'总计: 旧 {old_total:.2f}s, 新 {new_total:.2f}s, 加速 {old_total / new_total:.1f}x')
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+阅读页吞吐基准：每次调用新建 SQLite 连接（旧） vs. 每线程复用连接 + WAL/调优 PRAGMA（新）
+
+用法: python bench_reader.py [--novels 50] [--clients 8] [--seconds 10]
+在临时目录生成书库和记录文件，启动多线程 werkzeug 服务后并发请求 /reader/<id>?chapter=N。
+"""
+import argparse
+import logging
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from werkzeug.serving import make_server
+
+import utils
+import utils_mark
+import utils_read_record
+
+
+def unpooled_get_db(path=None):
+    # 旧实现：每次调用都新建连接，不做任何 PRAGMA 设置
+    conn = sqlite3.connect(str(path or utils.DB_PATH))
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def make_library(root: Path, novels: int):
+    para = '他抬头望向远处的群山，心中默默想着接下来该怎么走。\n'
+    for i in range(novels):
+        text = ''.join(f'第{j}章 山雨欲来\n' + para * 30 for j in range(1, 201))
+        (root / f'novel_{i}.txt').write_text(text, encoding='utf-8')
+
+
+def run_load(base_url, ids, clients, seconds):
+    stop = time.time() + seconds
+    counts = []
+
+    def worker():
+        n = 0
+        while time.time() < stop:
+            url = f'{base_url}/reader/{random.choice(ids)}?chapter={random.randint(1, 200)}'
+            with urllib.request.urlopen(url) as resp:
+                resp.read()
+            n += 1
+        counts.append(n)
+
+    with ThreadPoolExecutor(max_workers=clients) as ex:
+        for _ in range(clients):
+            ex.submit(worker)
+    return sum(counts) / seconds
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--novels', type=int, default=50)
+    ap.add_argument('--clients', type=int, default=8)
+    ap.add_argument('--seconds', type=float, default=10)
+    args = ap.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    utils.DB_PATH = tmp / 'novels.db'
+    utils_read_record.RECORD_DIR = utils_mark.RECORD_DIR = tmp
+    utils_read_record.LOG_FILE = tmp / 'read_log.csv'
+    utils_read_record.NODE_FILE = tmp / 'read_node.csv'
+    utils_read_record.PROGRESS_FILE = tmp / 'read_progress.csv'
+    utils_read_record.DB_FILE = tmp / 'records.db'
+    utils_mark.MARK_FILE = tmp / 'mark.csv'
+    try:
+        books = tmp / 'books'
+        books.mkdir()
+        make_library(books, args.novels)
+        utils.init_db()
+        utils.index_files(books.glob('*.txt'), progress=None)
+        ids = [r[0] for r in utils.get_db().execute('SELECT id FROM novels')]
+        # 预先生成全部章节表，避免首次访问的建表开销混入结果
+        for r in utils.get_db().execute('SELECT * FROM novels').fetchall():
+            utils.ensure_chapters(r)
+
+        from app import app
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        pooled_get_db, pooled_release = utils.get_db, utils.release_db
+        results = {}
+        for mode in ('before', 'after'):
+            utils.close_db()
+            if mode == 'before':
+                for db in (utils.DB_PATH, utils_read_record.DB_FILE):
+                    conn = sqlite3.connect(str(db))
+                    conn.execute('PRAGMA journal_mode=DELETE')
+                    conn.close()
+                utils.get_db, utils.release_db = unpooled_get_db, lambda: None
+            else:
+                utils.get_db, utils.release_db = pooled_get_db, pooled_release
+            run_load(base_url, ids, args.clients, 1)  # 预热
+            results[mode] = run_load(base_url, ids, args.clients, args.seconds)
+            print(f'{mode:<8}{results[mode]:>10.1f} req/s')
+        print(f'提升: {results["after"] / results["before"]:.2f}x')
+        server.shutdown()
+        utils_read_record.get_writer().stop()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
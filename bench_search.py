@@ -0,0 +1,80 @@
+"""
+搜索基准：LIKE 全表扫描 vs. FTS5 trigram 索引
+
+用法: python bench_search.py [--rows 100000] [--repeat 20]
+在临时数据库中生成随机书库，跑完自动删除。
+"""
+import argparse
+import datetime
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import utils
+import services
+
+CHARS = '天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜金生丽水玉出昆冈剑号巨阙珠称夜光'
+
+
+def rand_text(n):
+    return ''.join(random.choice(CHARS) for _ in range(n))
+
+
+def build_db(rows):
+    utils.init_db()
+    conn = utils.get_db()
+    now = datetime.datetime.utcnow()
+    batch = []
+    for i in range(rows):
+        name = rand_text(random.randint(4, 12)) + '.txt'
+        batch.append((name, f'/books/{i}/{name}', rand_text(100), (now - datetime.timedelta(seconds=i)).isoformat(), 0, 0))
+        if len(batch) >= 10000:
+            conn.executemany('INSERT INTO novels (filename, path, first100, added_at, size, chars) VALUES (?,?,?,?,?,?)', batch)
+            batch = []
+    if batch:
+        conn.executemany('INSERT INTO novels (filename, path, first100, added_at, size, chars) VALUES (?,?,?,?,?,?)', batch)
+    conn.commit()  # 连接来自 utils.get_db 的连接池，不能 close，后面的查询还要用
+
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - t0) / repeat, result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=100000)
+    ap.add_argument('--repeat', type=int, default=20)
+    args = ap.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    utils.DB_PATH = tmp / 'bench.db'
+    try:
+        t0 = time.perf_counter()
+        build_db(args.rows)
+        print(f'生成 {args.rows} 行，用时 {time.perf_counter() - t0:.1f}s')
+        if not utils.FTS_AVAILABLE:
+            print('当前 SQLite 不支持 FTS5 trigram，无法对比')
+            return
+        queries = [rand_text(3), rand_text(4), CHARS[:3]]
+        print(f'{"查询":<10}{"模式":<10}{"LIKE":>12}{"FTS5":>12}{"命中":>10}')
+        for q in queries:
+            for mode, args_q in (('filename', (q, '')), ('all', (q, q))):
+                utils.FTS_AVAILABLE = False
+                like_t, (_, like_total) = timed(lambda: services.search_novels(*args_q, page_size=50, with_total=True), args.repeat)
+                utils.FTS_AVAILABLE = True
+                fts_t, (_, fts_total) = timed(lambda: services.search_novels(*args_q, page_size=50, with_total=True), args.repeat)
+                print(f'{q:<10}{mode:<10}{like_t * 1000:>10.2f}ms{fts_t * 1000:>10.2f}ms{fts_total:>10}')
+                if like_total != fts_total:
+                    print(f'  注意: LIKE 命中 {like_total} 条，FTS5 命中 {fts_total} 条')
+    finally:
+        utils.close_db()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
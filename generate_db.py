@@ -1,30 +1,52 @@
+import argparse
 import shutil
 from pathlib import Path
 import utils
 import datetime
 
-DB = utils.DB_PATH
-if DB.exists():
-    bak = DB.with_suffix('.db.bak')
-    try:
-        shutil.copy2(DB, bak)
-        print(f'Existing DB backed up to {bak}')
-    except Exception as e:
-        print(f'Backup failed: {e}')
-    try:
-        DB.unlink()
-        print('Removed existing DB')
-    except Exception as e:
-        print(f'Failed to remove existing DB: {e}')
-
-# initialize new DB
-utils.init_db()
-# index all .txt files under NOVELS_DIR
-count = 0
-for p in utils.NOVELS_DIR.rglob('*.txt'):
-    ok, err = utils.index_file(p)
-    if ok:
-        count += 1
+
+def rebuild():
+    DB = utils.DB_PATH
+    if DB.exists():
+        bak = DB.with_suffix('.db.bak')
+        try:
+            shutil.copy2(DB, bak)
+            print(f'Existing DB backed up to {bak}')
+        except Exception as e:
+            print(f'Backup failed: {e}')
+        try:
+            utils.close_db()
+            DB.unlink()
+            # WAL 模式下的附属文件也一并删除
+            for suffix in ('-wal', '-shm'):
+                Path(str(DB) + suffix).unlink(missing_ok=True)
+            print('Removed existing DB')
+        except Exception as e:
+            print(f'Failed to remove existing DB: {e}')
+
+    # initialize new DB
+    utils.init_db()
+    # index all .txt files under NOVELS_DIR
+    ok, failed, _ = utils.index_files(utils.NOVELS_DIR.rglob('*.txt'))
+    print(f'Indexed {ok} files into {utils.DB_PATH} ({failed} failed)')
+
+
+def sync():
+    utils.init_db()
+    ok, failed, removed, unchanged = utils.sync_directory(utils.NOVELS_DIR)
+    print(f'Synced {utils.NOVELS_DIR}: {ok} indexed, {removed} removed, {unchanged} unchanged, {failed} failed')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index novels/ into novels.db')
+    parser.add_argument('--rebuild', action='store_true', help='back up and wipe the DB, then index everything from scratch')
+    args = parser.parse_args()
+    if args.rebuild:
+        rebuild()
     else:
-        print(f'Failed to index {p}: {err}')
-print(f'Indexed {count} files into {utils.DB_PATH}')
+        sync()
+
+
+# 子进程（spawn 方式）会重新导入本模块，入口必须放在 main 保护下
+if __name__ == '__main__':
+    main()
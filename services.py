@@ -5,7 +5,6 @@ def mark_novel(user, novel_id, score, tag=None):
     conn = utils.get_db()
     cur = conn.execute('SELECT filename, path FROM novels WHERE id = ?', (novel_id,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         return False
     utils_mark.write_mark(user, novel_id, row['filename'], row['path'], score, tag)
@@ -14,26 +13,68 @@ def mark_novel(user, novel_id, score, tag=None):
 def get_novel_mark(user, novel_id):
     return utils_mark.get_mark(user, novel_id)
 
+def get_novel_marks(user, novel_ids):
+    return utils_mark.get_marks(user, novel_ids)
+
 def get_all_tags():
     return utils_mark.get_all_tags()
 import utils_read_record
+import threading
+from collections import OrderedDict
 from pathlib import Path
 import utils
 
-# 小说列表
+# 小说列表（按 added_at, id 倒序的游标分页）
+
+def _cursor(row):
+    return f"{row['added_at']}_{row['id']}"
+
+
+def _parse_cursor(cursor):
+    """解析游标，格式不对（手改过的 URL 等）时返回 None，按第一页处理"""
+    if not cursor:
+        return None
+    added_at, sep, nid = cursor.rpartition('_')
+    try:
+        return (added_at, int(nid)) if sep else None
+    except ValueError:
+        return None
+
 
-def list_novels(page=1, page_size=20, with_total=False):
+def list_novels(page_size=20, after=None, before=None):
+    """返回 (本页小说, 下一页游标, 上一页游标)；游标为 None 表示没有更多"""
+    cols = 'id, filename, first100, added_at, size, chars'
     conn = utils.get_db()
-    offset = (page - 1) * page_size
-    cur = conn.execute('SELECT id, filename, first100, added_at, size, chars FROM novels ORDER BY added_at DESC LIMIT ? OFFSET ?', (page_size, offset))
-    novels = cur.fetchall()
-    total = None
-    if with_total:
-        total = conn.execute('SELECT COUNT(*) FROM novels').fetchone()[0]
-    conn.close()
-    if with_total:
-        return novels, total
-    return novels
+    after, before = _parse_cursor(after), _parse_cursor(before)
+    if before:
+        cur = conn.execute(
+            f'SELECT {cols} FROM novels WHERE (added_at, id) > (?, ?) ORDER BY added_at, id LIMIT ?',
+            (*before, page_size + 1)
+        )
+        rows = cur.fetchall()
+        has_prev = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after:
+            cur = conn.execute(
+                f'SELECT {cols} FROM novels WHERE (added_at, id) < (?, ?) ORDER BY added_at DESC, id DESC LIMIT ?',
+                (*after, page_size + 1)
+            )
+        else:
+            cur = conn.execute(f'SELECT {cols} FROM novels ORDER BY added_at DESC, id DESC LIMIT ?', (page_size + 1,))
+        rows = cur.fetchall()
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = after is not None
+    next_cursor = _cursor(rows[-1]) if rows and has_next else None
+    prev_cursor = _cursor(rows[0]) if rows and has_prev else None
+    return rows, next_cursor, prev_cursor
+
+
+def count_novels():
+    row = utils.get_db().execute("SELECT value FROM novel_stats WHERE key = 'count'").fetchone()
+    return row[0] if row else 0
 
 # 索引文件或目录
 
@@ -42,66 +83,145 @@ def index_path(path_str):
     if not candidate.is_absolute():
         candidate = utils.NOVELS_DIR / candidate
     if candidate.exists() and candidate.is_dir():
-        count = 0
-        for p in candidate.rglob('*.txt'):
-            ok, _ = utils.index_file(p)
-            if ok:
-                count += 1
-            print(f'\rIndexed: {count} - {"Success" if ok else "Failed"}', end='')
-        print()  # Move to the next line after the loop
-        return True, f'已索引目录 {candidate} 下 {count} 个文件（.txt）'
+        ok, failed, removed, unchanged = utils.sync_directory(candidate)
+        clear_name_cache()
+        return True, f'已同步目录 {candidate}（.txt）：新增/更新 {ok} 个，删除 {removed} 个，未变化 {unchanged} 个，失败 {failed} 个'
     ok, err = utils.index_file(candidate)
+    clear_name_cache()
     if ok:
         return True, f'已索引: {candidate}'
     else:
         return False, f'索引失败: {err}'
 
+# 按文件名精确查找（name_key 索引，一次 B-tree 查询），命中结果缓存
+
+NAME_CACHE_SIZE = 4096
+_name_cache = OrderedDict()
+_name_cache_lock = threading.Lock()
+
+
+def find_novel_by_name(filename):
+    # 缓存按去空白后的原文件名区分：a.md 与 a.txt 的 name_key 相同，但完全一致的优先，结果可能不同
+    filename = filename.strip()
+    key = utils.name_key(filename)
+    conn = utils.get_db()
+    with _name_cache_lock:
+        nid = _name_cache.get(filename)
+    if nid is not None:
+        # generate_db.py、tag_movefile.py 等在其他进程里删行不会清这里的缓存，命中后按主键确认仍存在
+        if conn.execute('SELECT 1 FROM novels WHERE id = ? AND name_key = ?', (nid, key)).fetchone():
+            with _name_cache_lock:
+                if filename in _name_cache:
+                    _name_cache.move_to_end(filename)
+            return nid
+        with _name_cache_lock:
+            _name_cache.pop(filename, None)
+    # 同名（不同扩展名或目录）时优先文件名完全一致的，其次最新加入的
+    row = conn.execute(
+        'SELECT id FROM novels WHERE name_key = ? ORDER BY filename = ? DESC, id DESC LIMIT 1',
+        (key, filename)
+    ).fetchone()
+    if row is None:
+        return None
+    with _name_cache_lock:
+        _name_cache[filename] = row[0]
+        if len(_name_cache) > NAME_CACHE_SIZE:
+            _name_cache.popitem(last=False)
+    return row[0]
+
+
+def clear_name_cache():
+    with _name_cache_lock:
+        _name_cache.clear()
+
 # 搜索小说
 
-def search_novels(q_filename, q_text):
-    sql = 'SELECT id, filename, first100, added_at, path, size, chars FROM novels'
-    clauses = []
-    params = []
-    if q_filename:
-        clauses.append('filename LIKE ?')
-        params.append(f'%{q_filename}%')
-    if q_text:
-        clauses.append('first100 LIKE ?')
-        params.append(f'%{q_text}%')
-    if clauses:
-        sql += ' WHERE ' + ' OR '.join(clauses)
-    sql += ' ORDER BY added_at DESC LIMIT 200'
+FTS_MIN_QUERY_LEN = 3  # trigram 分词至少需要 3 个字符
+
+
+def _fts_phrase(q):
+    return '"' + q.replace('"', '""') + '"'
+
+
+def search_novels(q_filename, q_text, page=1, page_size=200, with_total=False):
+    offset = (page - 1) * page_size
+    queries = [q for q in (q_filename, q_text) if q]
+    use_fts = utils.FTS_AVAILABLE and queries and min(len(q) for q in queries) >= FTS_MIN_QUERY_LEN
     conn = utils.get_db()
-    cur = conn.execute(sql, params)
-    rows = cur.fetchall()
-    conn.close()
+    if use_fts:
+        parts = []
+        if q_filename:
+            parts.append(f'filename : {_fts_phrase(q_filename)}')
+        if q_text:
+            parts.append(f'{{first100 body}} : {_fts_phrase(q_text)}')
+        match = ' OR '.join(parts)
+        cur = conn.execute(
+            'SELECT n.id, n.filename, n.first100, n.added_at, n.path, n.size, n.chars '
+            'FROM novels_fts JOIN novels n ON n.id = novels_fts.rowid '
+            'WHERE novels_fts MATCH ? ORDER BY bm25(novels_fts, 10.0, 2.0, 1.0) LIMIT ? OFFSET ?',
+            (match, page_size, offset)
+        )
+        rows = cur.fetchall()
+        if with_total:
+            total = conn.execute('SELECT COUNT(*) FROM novels_fts WHERE novels_fts MATCH ?', (match,)).fetchone()[0]
+    else:
+        # 短查询（或不支持 FTS5）退回 LIKE 扫描
+        where = ''
+        clauses = []
+        params = []
+        if q_filename:
+            clauses.append('filename LIKE ?')
+            params.append(f'%{q_filename}%')
+        if q_text:
+            clauses.append('first100 LIKE ?')
+            params.append(f'%{q_text}%')
+        if clauses:
+            where = ' WHERE ' + ' OR '.join(clauses)
+        cur = conn.execute(
+            'SELECT id, filename, first100, added_at, path, size, chars FROM novels' + where +
+            ' ORDER BY added_at DESC LIMIT ? OFFSET ?',
+            params + [page_size, offset]
+        )
+        rows = cur.fetchall()
+        if with_total:
+            total = conn.execute('SELECT COUNT(*) FROM novels' + where, params).fetchone()[0]
+    if with_total:
+        return rows, total
     return rows
 
+# 流式输出全文
+
+def iter_novel_text(novel_id):
+    """返回 (文件名, 字节块迭代器, 总长度)；总长度仅在原文为 UTF-8 时可预先算出，否则为 None"""
+    conn = utils.get_db()
+    row = conn.execute('SELECT * FROM novels WHERE id = ?', (novel_id,)).fetchone()
+    if not row:
+        return None, None, None
+    path = Path(row['path'])
+    if not path.exists():
+        return None, None, None
+    chapters, encoding = utils.ensure_chapters(row)
+    length = utils.chapters_utf8_length(chapters, encoding)
+    return row['filename'], utils.iter_chapters_utf8(path, chapters, encoding), length
+
 # 获取小说分页内容
 
 def get_novel_page(novel_id, chapter_idx, page_num=None, page_size=None, user='default'):
     conn = utils.get_db()
     cur = conn.execute('SELECT * FROM novels WHERE id = ?', (novel_id,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         return None, None, None, None, None, None, None
     path = Path(row['path'])
-    if not path.exists():
-        content = ''
+    chapters = None
+    encoding = None
+    if path.exists():
+        try:
+            chapters, encoding = utils.ensure_chapters(row)
+        except Exception as e:
+            chapters = [{'title': f'读取文件失败: {e}', 'start': 0, 'end': 0}]
+    if not chapters:
         chapters = [{'title': '文件不存在', 'start': 0, 'end': 0}]
-    else:
-        content, mtime = utils.memdb_get(str(path.resolve()))
-        if content is None:
-            try:
-                content = utils.read_text_with_encoding(path)
-            except Exception as e:
-                content = f'读取文件失败: {e}'
-            try:
-                utils.memdb_set(str(path.resolve()), content, path.stat().st_mtime)
-            except Exception:
-                pass
-        chapters = utils.extract_chapters(content)
     # 仅在未指定章节时自动跳转到历史节点
     node = None
     if chapter_idx is None:
@@ -111,10 +231,18 @@ def get_novel_page(novel_id, chapter_idx, page_num=None, page_size=None, user='d
     if chapter_idx is None or chapter_idx < 0 or chapter_idx >= len(chapters):
         chapter_idx = 0
     chap = chapters[chapter_idx]
-    chapter_text = content[chap['start']:chap['end']] if chap['end'] > chap['start'] else ''
+    chapter_text = ''
+    if chap['end'] > chap['start']:
+        try:
+            if encoding and chap.get('byte_end') is not None:
+                chapter_text = utils.read_byte_range(path, chap['byte_start'], chap['byte_end'], encoding)
+            else:
+                chapter_text = utils.load_text(path, encoding)[chap['start']:chap['end']]
+        except Exception as e:
+            chapter_text = f'读取文件失败: {e}'
     # 记录整章节，无分页
     utils_read_record.write_read_log(user, novel_id, chapter_idx, 1)
-    total_chars = len(content)
+    total_chars = chapters[-1]['end']
     read_chars = chap['end']
     percent = round(read_chars / total_chars * 100, 2) if total_chars > 0 else 0
     utils_read_record.write_read_node(user, novel_id, chapter_idx, 1, filename=row['filename'], total_chars=total_chars, percent=percent)
@@ -1,24 +1,7 @@
 import csv
-import os
 import shutil
 from pathlib import Path
-import sqlite3
-from pathlib import Path
-import datetime
-import re
-import chardet
-import threading
-
-BASE_DIR = Path(__file__).parent
-DB_PATH = BASE_DIR / 'novels.db'
-NOVELS_DIR = BASE_DIR / 'novels'
-NOVELS_DIR.mkdir(parents=True, exist_ok=True)
-
-
-def get_db():
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row
-    return conn
+import utils
 
 files=[]
 def move_file():
@@ -60,7 +43,7 @@ def move_file():
 
 def del_data():
     global files
-    conn = get_db()
+    conn = utils.get_db()
     cnt_data=conn.execute('select count(*) from novels').fetchone()[0]
     print("删除前数据量:",cnt_data)
     for f in files:
@@ -69,7 +52,6 @@ def del_data():
     cnt_data2=conn.execute('select count(*) from novels').fetchone()[0]
     # print("删除后数据量:",cnt_data)
     print("删除数据：",cnt_data-cnt_data2)
-    conn.close()
 if __name__ == "__main__":
     move_file()
     del_data()
\ No newline at end of file
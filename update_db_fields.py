@@ -1,6 +1,7 @@
 from pathlib import Path
-import sqlite3
 from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import queue
+import threading
 import time
 import utils
 
@@ -17,10 +18,6 @@ def _process_row(row):
             text = utils.read_text_with_encoding(p)
             chars = len(text)
             size = p.stat().st_size
-            try:
-                utils.memdb_set(str(p.resolve()), text, p.stat().st_mtime)
-            except Exception:
-                pass
         except Exception:
             try:
                 size = p.stat().st_size
@@ -31,6 +28,47 @@ def _process_row(row):
     return nid, size, chars, duration
 
 
+# 后台补全：请求中遇到 size/chars 为空的行只负责排队，由单独线程逐个补全
+BACKFILL_QUEUE_SIZE = 10000
+
+_backfill_queue = queue.Queue(BACKFILL_QUEUE_SIZE)
+_backfill_pending = set()
+_backfill_lock = threading.Lock()
+_backfill_thread = None
+
+
+def _backfill_loop():
+    while True:
+        row = _backfill_queue.get()
+        try:
+            nid, size, chars, _ = _process_row(row)
+            conn = utils.get_db()
+            conn.execute('UPDATE novels SET size = ?, chars = ? WHERE id = ?', (size, chars, nid))
+            conn.commit()
+        except Exception as e:
+            print(f'Backfill failed for id={row["id"]}: {e}')
+        finally:
+            with _backfill_lock:
+                _backfill_pending.discard(row['id'])
+
+
+def enqueue_backfill(rows):
+    """把缺少 size/chars 的行交给后台线程补全；已在队列中的行不会重复加入"""
+    global _backfill_thread
+    with _backfill_lock:
+        if _backfill_thread is None:
+            _backfill_thread = threading.Thread(target=_backfill_loop, name='backfill', daemon=True)
+            _backfill_thread.start()
+        for row in rows:
+            if row['id'] in _backfill_pending:
+                continue
+            try:
+                _backfill_queue.put_nowait({'id': row['id'], 'path': row['path']})
+            except queue.Full:
+                break
+            _backfill_pending.add(row['id'])
+
+
 def main(thread_workers: int = 8, batch_commit: int = 100, wait_timeout: float = 2.0):
     conn = utils.get_db()
     cur = conn.execute('SELECT id, path FROM novels where size IS NULL OR chars IS NULL')
@@ -83,7 +121,6 @@ def main(thread_workers: int = 8, batch_commit: int = 100, wait_timeout: float =
         conn.commit()
         print(f'Batch committed: {len(batch_results)} rows updated. Total updated: {overall_updated}')
 
-    conn.close()
     print(f'Done. Updated {overall_updated} / {total} rows. Elapsed: {time.time()-start_all:.1f}s')
 
 
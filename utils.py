@@ -1,44 +1,102 @@
-# 按起止位置读取章节内容
-def read_chapter_text(novel_id, start, end):
-    conn = get_db()
-    cur = conn.execute('SELECT path FROM novels WHERE id = ?', (novel_id,))
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        return ''
-    path = Path(row['path'])
-    if not path.exists():
-        return ''
-    content, _ = memdb_get(str(path.resolve()))
-    if content is None:
-        try:
-            content = read_text_with_encoding(path)
-        except Exception:
-            return ''
-        try:
-            memdb_set(str(path.resolve()), content, path.stat().st_mtime)
-        except Exception:
-            pass
-    return content[start:end] if end > start else ''
 import sqlite3
 from pathlib import Path
+import os
+import sys
 import datetime
 import re
+import codecs
+import contextlib
+import unicodedata
+import mmap
 import chardet
 import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import OrderedDict
 
 BASE_DIR = Path(__file__).parent
 DB_PATH = BASE_DIR / 'novels.db'
 NOVELS_DIR = BASE_DIR / 'novels'
 NOVELS_DIR.mkdir(parents=True, exist_ok=True)
+# 是否把全文写入 FTS 索引（会显著增大数据库），默认只索引文件名和前100字
+FTS_INDEX_BODY = os.environ.get('NOVEL_FTS_BODY') == '1'
+FTS_AVAILABLE = True
+
+
+# 连接管理：每个线程复用自己的连接；请求结束时归还连接池，供后续请求线程直接取用
+DB_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA temp_store=MEMORY',
+)
+DB_POOL_SIZE = 16
+DB_STATEMENT_CACHE = 256
 
+_db_local = threading.local()
+_db_pool = {}
+_db_pool_lock = threading.Lock()
 
-def get_db():
-    conn = sqlite3.connect(str(DB_PATH))
+
+def _connect(path: str):
+    # check_same_thread=False：连接会在线程间传递，但同一时刻只归一个线程使用
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
     conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
+def get_db(path=None):
+    """返回当前线程的连接（默认 novels.db）；调用方不要 close，由 release_db 统一回收"""
+    path = str(path or DB_PATH)
+    conns = getattr(_db_local, 'conns', None)
+    if conns is None:
+        conns = _db_local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        with _db_pool_lock:
+            free = _db_pool.get(path)
+            conn = free.pop() if free else None
+        if conn is None:
+            conn = _connect(path)
+        conns[path] = conn
+    return conn
+
+
+def release_db():
+    """把当前线程持有的连接归还连接池"""
+    conns = getattr(_db_local, 'conns', None)
+    if not conns:
+        return
+    _db_local.conns = {}
+    for path, conn in conns.items():
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            continue
+        with _db_pool_lock:
+            free = _db_pool.setdefault(path, [])
+            if len(free) < DB_POOL_SIZE:
+                free.append(conn)
+                continue
+        conn.close()
+
+
+def close_db():
+    """关闭当前线程和连接池中的所有连接（重建数据库前调用）"""
+    conns = getattr(_db_local, 'conns', None) or {}
+    _db_local.conns = {}
+    with _db_pool_lock:
+        pooled = [c for free in _db_pool.values() for c in free]
+        _db_pool.clear()
+    for conn in list(conns.values()) + pooled:
+        conn.close()
+
+
 def init_db():
     conn = get_db()
     # Create table with new columns if not exists
@@ -66,26 +124,243 @@ def init_db():
             conn.execute('ALTER TABLE novels ADD COLUMN chars INTEGER')
         except Exception:
             pass
+    if 'mtime' not in cols:
+        try:
+            conn.execute('ALTER TABLE novels ADD COLUMN mtime REAL')
+        except Exception:
+            pass
+    if 'encoding' not in cols:
+        try:
+            conn.execute('ALTER TABLE novels ADD COLUMN encoding TEXT')
+        except Exception:
+            pass
+    if 'name_key' not in cols:
+        try:
+            conn.execute('ALTER TABLE novels ADD COLUMN name_key TEXT')
+        except Exception:
+            pass
+    # 旧数据补齐文件名查找键
+    rows = conn.execute('SELECT id, filename FROM novels WHERE name_key IS NULL').fetchall()
+    if rows:
+        conn.executemany('UPDATE novels SET name_key = ? WHERE id = ?', [(name_key(r[1] or ''), r[0]) for r in rows])
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_novels_name_key ON novels(name_key)')
+    # 章节表：索引时生成一次，阅读时按 (novel_id, idx) 直接查
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS chapters (
+        novel_id INTEGER NOT NULL,
+        idx INTEGER NOT NULL,
+        title TEXT,
+        char_start INTEGER,
+        char_end INTEGER,
+        byte_start INTEGER,
+        byte_end INTEGER,
+        PRIMARY KEY (novel_id, idx)
+    )
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS chapters_novel_ad AFTER DELETE ON novels BEGIN
+        DELETE FROM chapters WHERE novel_id = old.id;
+    END
+    ''')
     # Create an index on filename for faster lookup
     try:
         conn.execute('CREATE INDEX IF NOT EXISTS idx_novels_filename ON novels(filename)')
     except Exception:
         pass
+    # 首页按 (added_at, id) 做游标分页
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_novels_added_at ON novels(added_at DESC, id DESC)')
+    # 由触发器维护的总数，首页不再每次 COUNT(*)
+    conn.execute('CREATE TABLE IF NOT EXISTS novel_stats (key TEXT PRIMARY KEY, value INTEGER)')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS novel_stats_ai AFTER INSERT ON novels BEGIN
+        UPDATE novel_stats SET value = value + 1 WHERE key = 'count';
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS novel_stats_ad AFTER DELETE ON novels BEGIN
+        UPDATE novel_stats SET value = value - 1 WHERE key = 'count';
+    END
+    ''')
+    conn.execute("INSERT OR IGNORE INTO novel_stats (key, value) SELECT 'count', COUNT(*) FROM novels")
+    init_fts(conn)
     conn.commit()
-    conn.close()
 
 
-def read_text_with_encoding(file_path: Path) -> str:
+NAME_KEY_EXTENSIONS = ('.txt', '.md', '.epub')
+
+
+def name_key(filename: str) -> str:
+    """文件名查找键：NFKC 归一化、去首尾空白、转小写，并去掉常见文本扩展名"""
+    key = unicodedata.normalize('NFKC', filename).strip().lower()
+    for ext in NAME_KEY_EXTENSIONS:
+        if key.endswith(ext):
+            return key[:-len(ext)]
+    return key
+
+
+def init_fts(conn):
+    """FTS5 全文索引（trigram 分词，支持中文子串），由触发器与 novels 表保持同步"""
+    global FTS_AVAILABLE
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'novels_fts'").fetchone() is not None
     try:
-        return file_path.read_text(encoding='utf-8')
-    except Exception:
-        raw = file_path.read_bytes()
-        info = chardet.detect(raw)
-        enc = info.get('encoding') or 'utf-8'
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS novels_fts USING fts5(filename, first100, body, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        # SQLite 版本过旧（< 3.34）不支持 trigram，搜索退回 LIKE
+        FTS_AVAILABLE = False
+        return
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS novels_fts_ai AFTER INSERT ON novels BEGIN
+        INSERT INTO novels_fts (rowid, filename, first100) VALUES (new.id, new.filename, new.first100);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS novels_fts_ad AFTER DELETE ON novels BEGIN
+        DELETE FROM novels_fts WHERE rowid = old.id;
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS novels_fts_au AFTER UPDATE OF filename, first100 ON novels BEGIN
+        UPDATE novels_fts SET filename = new.filename, first100 = new.first100 WHERE rowid = new.id;
+    END
+    ''')
+    if not exists:
+        conn.execute('INSERT INTO novels_fts (rowid, filename, first100) SELECT id, filename, first100 FROM novels')
+
+
+def fts_set_body(conn, novel_id, text):
+    if FTS_AVAILABLE and FTS_INDEX_BODY:
+        conn.execute('UPDATE novels_fts SET body = ? WHERE rowid = ?', (text, novel_id))
+
+
+def normalize_encoding(enc: str) -> str:
+    # chardet 常把 GBK 文本报成 GB2312，统一按超集 GB18030 解码，避免丢字导致字节偏移错位
+    name = codecs.lookup(enc).name
+    if name in ('gb2312', 'gbk'):
+        return 'gb18030'
+    return name
+
+
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+def _mostly_gb2312(text: str) -> bool:
+    # Big5 等双字节编码也能按 GB18030 解出来，但得到的多是生僻字；正常简体文本几乎都落在 GB2312 常用字内
+    non_ascii = len(text) - len(text.encode('ascii', errors='ignore'))
+    if non_ascii == 0:
+        return True
+    in_gb2312 = (len(text.encode('gb2312', errors='ignore')) - (len(text) - non_ascii)) // 2
+    return in_gb2312 >= non_ascii * 0.95
+
+
+def detect_encoding(sample: bytes) -> str:
+    """根据文件开头的样本判断编码：先增量尝试 UTF-8 / GB18030，都不像时才用 chardet"""
+    # 带 BOM 时返回固定字节序的编码：BOM 解成文本开头的 U+FEFF，字符位置与字节位置仍一一对应，
+    # 章节的字节片段也能单独解码（'utf-16' 会吞掉 BOM，片段按本机字节序解码，大端文件全是乱码）
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8'
+    if sample.startswith(codecs.BOM_UTF16_LE):
+        return 'utf-16-le'
+    if sample.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16-be'
+    # final=False：样本末尾被截断的半个字符不算错误
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        text = codecs.getincrementaldecoder('gb18030')().decode(sample, final=False)
+        if _mostly_gb2312(text):
+            return 'gb18030'
+    except UnicodeDecodeError:
+        pass
+    info = chardet.detect(sample)
+    try:
+        return normalize_encoding(info.get('encoding') or 'utf-8')
+    except LookupError:
+        return 'utf-8'
+
+
+def read_text_and_encoding(file_path: Path, encoding: str = None):
+    """
+    读取全文并返回 (文本, 编码)。未给出编码时按样本检测；
+    样本判断失误（如文件后半段混入其他编码）时才在全文上重新检测。
+    """
+    # 按字节解码（不做换行转换），保证字符位置和字节位置一一对应
+    raw = file_path.read_bytes()
+    enc = encoding or detect_encoding(raw[:ENCODING_SAMPLE_SIZE])
+    try:
+        return raw.decode(enc), enc
+    except UnicodeDecodeError:
+        if encoding:
+            return raw.decode(enc, errors='ignore'), enc
+    for enc in ('utf-8', 'gb18030'):
         try:
-            return raw.decode(enc, errors='ignore')
-        except Exception:
-            return raw.decode('utf-8', errors='ignore')
+            return raw.decode(enc), enc
+        except UnicodeDecodeError:
+            pass
+    info = chardet.detect(raw)
+    try:
+        enc = normalize_encoding(info.get('encoding') or 'utf-8')
+        return raw.decode(enc, errors='ignore'), enc
+    except Exception:
+        return raw.decode('utf-8', errors='ignore'), 'utf-8'
+
+
+STREAM_BLOCK_SIZE = 256 * 1024
+
+
+def bomless_codec(encoding: str, head: bytes) -> str:
+    """
+    'utf-16' / 'utf-32' 只在流的开头认 BOM，单独解码中间的字节片段会报错或按本机字节序解成乱码；
+    按文件开头的 BOM 换成固定字节序的编码，任意章节片段都能独立解码
+    """
+    name = codecs.lookup(encoding).name
+    if name == 'utf-16':
+        return 'utf-16-be' if head.startswith(codecs.BOM_UTF16_BE) else 'utf-16-le'
+    if name == 'utf-32':
+        return 'utf-32-be' if head.startswith(codecs.BOM_UTF32_BE) else 'utf-32-le'
+    return name
+
+
+def chapters_utf8_length(chapters, encoding: str):
+    """iter_chapters_utf8 输出的总字节数；只有原文为 UTF-8（正文原样输出）时能预先算出，否则为 None"""
+    if codecs.lookup(encoding).name != 'utf-8':
+        return None
+    return sum(len(c['title'].encode('utf-8')) + 1 + (c['byte_end'] - c['byte_start']) + 1 for c in chapters)
+
+
+def iter_chapters_utf8(file_path: Path, chapters, encoding: str, block_size: int = STREAM_BLOCK_SIZE):
+    """按章节顺序产出 UTF-8 字节块（标题 + 正文），整个过程只打开、映射文件一次"""
+    with file_path.open('rb') as f:
+        # 空文件不能 mmap，但章节标题照常输出，保证与 chapters_utf8_length 一致
+        empty = f.seek(0, 2) == 0
+        with (contextlib.nullcontext(b'') if empty else mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as mm:
+            encoding = bomless_codec(encoding, mm[:4])
+            passthrough = encoding == 'utf-8'
+            for c in chapters:
+                yield (c['title'] + '\n').encode('utf-8')
+                decoder = None if passthrough else codecs.getincrementaldecoder(encoding)(errors='ignore')
+                for pos in range(c['byte_start'], c['byte_end'], block_size):
+                    block = mm[pos:min(pos + block_size, c['byte_end'])]
+                    yield block if decoder is None else decoder.decode(block).encode('utf-8')
+                if decoder is not None:
+                    yield decoder.decode(b'', final=True).encode('utf-8')
+                yield b'\n'
+
+
+def read_byte_range(file_path: Path, start: int, end: int, encoding: str) -> str:
+    """用 mmap 只解码 [start, end) 这段字节，内存占用只与章节大小有关"""
+    if end <= start:
+        return ''
+    with file_path.open('rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # 旧记录的编码可能是 'utf-16'，按文件开头的 BOM 定字节序
+            return mm[start:end].decode(bomless_codec(encoding, mm[:4]), errors='ignore')
+
+
+def read_text_with_encoding(file_path: Path, encoding: str = None) -> str:
+    return read_text_and_encoding(file_path, encoding)[0]
 
 
 def auto_split_into_chapters(text: str, chunk_size: int = 10000):
@@ -114,7 +389,8 @@ def auto_split_into_chapters(text: str, chunk_size: int = 10000):
 
 
 def extract_chapters(text: str):
-    patterns = [r'(^\s*第[^\n]{1,30}章[^\n]*)', r'(^\s*Chapter\s+\d+[^\n]*)']
+    # 文件开头的 BOM（解码后为 U+FEFF）不算进标题，第一章从 BOM 之后开始
+    patterns = [r'^\ufeff?(\s*第[^\n]{1,30}章[^\n]*)', r'^\ufeff?(\s*Chapter\s+\d+[^\n]*)']
     matches = []
     for pat in patterns:
         for m in re.finditer(pat, text, flags=re.IGNORECASE | re.MULTILINE):
@@ -129,77 +405,331 @@ def extract_chapters(text: str):
     return chapters
 
 
-# in-memory sqlite cache
-_MEM_DB_CONN = None
-_MEM_DB_LOCK = threading.Lock()
+def add_byte_offsets(text: str, chapters, encoding: str):
+    """为章节补充 byte_start/byte_end（按文件原始编码计算）"""
+    encoder = codecs.getincrementalencoder(encoding)(errors='ignore')
+    bounds = sorted({c['start'] for c in chapters} | {c['end'] for c in chapters})
+    offsets = {}
+    pos_char = 0
+    pos_byte = 0
+    for b in bounds:
+        pos_byte += len(encoder.encode(text[pos_char:b]))
+        pos_char = b
+        offsets[b] = pos_byte
+    for c in chapters:
+        c['byte_start'] = offsets[c['start']]
+        c['byte_end'] = offsets[c['end']]
+    return chapters
+
+
+def save_chapters(conn, novel_id, chapters):
+    conn.execute('DELETE FROM chapters WHERE novel_id = ?', (novel_id,))
+    conn.executemany(
+        'INSERT INTO chapters (novel_id, idx, title, char_start, char_end, byte_start, byte_end) VALUES (?,?,?,?,?,?,?)',
+        [(novel_id, i, c['title'], c['start'], c['end'], c.get('byte_start'), c.get('byte_end')) for i, c in enumerate(chapters)]
+    )
+
+
+def get_chapters(conn, novel_id):
+    cur = conn.execute(
+        'SELECT title, char_start, char_end, byte_start, byte_end FROM chapters WHERE novel_id = ? ORDER BY idx',
+        (novel_id,)
+    )
+    return [{'title': r[0], 'start': r[1], 'end': r[2], 'byte_start': r[3], 'byte_end': r[4]} for r in cur.fetchall()]
+
+
+def ensure_chapters(row):
+    """返回 (章节表, 编码)；文件 mtime/size 与库中不一致或尚无章节时重新生成"""
+    path = Path(row['path'])
+    st = path.stat()
+    conn = get_db()
+    if row['mtime'] == st.st_mtime and row['size'] == st.st_size and row['encoding']:
+        chapters = get_chapters(conn, row['id'])
+        if chapters:
+            return chapters, row['encoding']
+    rec = scan_file(row['path'])
+    if 'error' in rec:
+        raise OSError(rec['error'])
+    write_records(conn, [rec])
+    conn.commit()
+    return rec['chapters'], rec['encoding']
+
+
+# 进程内全文缓存：按字节预算做 LRU 淘汰，命中时校验 mtime/size
+TEXT_CACHE_MAX_BYTES = int(os.environ.get('NOVEL_TEXT_CACHE_MB', '256')) * 1024 * 1024
+
+
+class TextCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # path -> (text, mtime, size, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get(self, path: str, mtime: float, size: int):
+        with self._lock:
+            item = self._items.get(path)
+            if item is None:
+                self.misses += 1
+                return None
+            text, c_mtime, c_size, nbytes = item
+            if c_mtime != mtime or c_size != size:
+                # 文件已被修改，丢弃旧内容
+                del self._items[path]
+                self._bytes -= nbytes
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(path)
+            self.hits += 1
+            return text
+
+    def set(self, path: str, text: str, mtime: float, size: int):
+        nbytes = sys.getsizeof(text)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(path, None)
+            if old is not None:
+                self._bytes -= old[3]
+            self._items[path] = (text, mtime, size, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= evicted[3]
+                self.evictions += 1
+
+    def invalidate(self, path: str):
+        with self._lock:
+            old = self._items.pop(path, None)
+            if old is not None:
+                self._bytes -= old[3]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'items': len(self._items),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'stale': self.stale,
+            }
+
+
+text_cache = TextCache(TEXT_CACHE_MAX_BYTES)
+
 
+def load_text(path: Path, encoding: str = None) -> str:
+    """读取全文，优先使用内存缓存；已知编码时直接按该编码解码"""
+    key = str(path.resolve())
+    st = path.stat()
+    content = text_cache.get(key, st.st_mtime, st.st_size)
+    if content is None:
+        content = read_text_with_encoding(path, encoding)
+        text_cache.set(key, content, st.st_mtime, st.st_size)
+    return content
+
+
+def scan_file(path_str: str):
+    """读取、解码并切分章节，返回可直接写库的记录；可在子进程中执行"""
+    p = Path(path_str)
+    try:
+        st = p.stat()
+        text, enc = read_text_and_encoding(p)
+    except Exception as e:
+        return {'path': path_str, 'error': str(e)}
+    return {
+        'path': path_str,
+        'filename': p.name,
+        'first100': ' '.join(text.lstrip('\ufeff').split())[:100],
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'chars': len(text),
+        'encoding': enc,
+        'chapters': add_byte_offsets(text, extract_chapters(text), enc),
+        'body': text if FTS_INDEX_BODY else None,
+    }
+
+
+def write_records(conn, records):
+    """批量写入 scan_file 的结果（同一路径已存在时原地更新，保留 id），由调用方提交事务"""
+    now = datetime.datetime.utcnow().isoformat()
+    conn.executemany(
+        'INSERT INTO novels (filename, path, first100, added_at, size, chars, mtime, encoding, name_key) VALUES (?,?,?,?,?,?,?,?,?) '
+        'ON CONFLICT(path) DO UPDATE SET filename = excluded.filename, first100 = excluded.first100, '
+        'size = excluded.size, chars = excluded.chars, mtime = excluded.mtime, encoding = excluded.encoding, '
+        'name_key = excluded.name_key',
+        [(r['filename'], r['path'], r['first100'], now, r['size'], r['chars'], r['mtime'], r['encoding'], name_key(r['filename']))
+         for r in records]
+    )
+    ids = {}
+    paths = [r['path'] for r in records]
+    for i in range(0, len(paths), 900):
+        chunk = paths[i:i + 900]
+        placeholders = ','.join('?' * len(chunk))
+        for nid, path in conn.execute(f'SELECT id, path FROM novels WHERE path IN ({placeholders})', chunk):
+            ids[path] = nid
+    for r in records:
+        save_chapters(conn, ids[r['path']], r['chapters'])
+        if r.get('body') is not None:
+            fts_set_body(conn, ids[r['path']], r['body'])
+    return ids
+
+
+# 批量索引进度（供 /index/progress 查询）
+index_progress = {'running': False, 'done': 0, 'total': 0, 'failed': 0, 'elapsed': 0.0}
 
-def init_mem_db():
-    global _MEM_DB_CONN
-    with _MEM_DB_LOCK:
-        if _MEM_DB_CONN is None:
-            _MEM_DB_CONN = sqlite3.connect(':memory:', check_same_thread=False)
-            cur = _MEM_DB_CONN.cursor()
-            cur.execute('CREATE TABLE IF NOT EXISTS mem_cache (path TEXT PRIMARY KEY, text TEXT, mtime REAL)')
-            _MEM_DB_CONN.commit()
 
+def print_progress(done, total, failed, elapsed):
+    rate = done / elapsed if elapsed > 0 else 0
+    eta = (total - done) / rate if rate > 0 else 0
+    print(f'\r已索引 {done}/{total}，失败 {failed}，{rate:.1f} 个/秒，预计剩余 {eta:.0f}s', end='', flush=True)
+
+
+def index_files(paths, workers=None, batch_size=500, progress=print_progress):
+    """
+    并行批量索引：进程池负责读取+解码+切章（受 GIL 限制的部分），
+    当前线程作为唯一写入者，每 batch_size 条记录一个事务。
+    已入库且 mtime/size 未变的文件跳过，变化的文件原地更新。
+    返回 (成功数, 失败数, 跳过数)
+    """
+    paths = [str(Path(p).resolve()) for p in paths]
+    conn = get_db()
+    known = {r[0]: (r[1], r[2]) for r in conn.execute('SELECT path, mtime, size FROM novels')}
+    todo = [p for p in paths if p not in known or known[p] != _stat_key(p)]
+    skipped = len(paths) - len(todo)
+    total = len(todo)
+    workers = workers or os.cpu_count() or 1
+    ok = 0
+    failed = 0
+    pending = []
+    start = time.time()
+    index_progress.update(running=True, done=0, total=total, failed=0, elapsed=0.0)
+
+    def handle(rec):
+        nonlocal ok, failed
+        if 'error' in rec:
+            failed += 1
+        else:
+            pending.append(rec)
+        if len(pending) >= batch_size:
+            write_records(conn, pending)
+            conn.commit()
+            ok += len(pending)
+            pending.clear()
+        done = ok + failed + len(pending)
+        elapsed = time.time() - start
+        index_progress.update(done=done, failed=failed, elapsed=elapsed)
+        if progress and (done == total or done % 20 == 0):
+            progress(done, total, failed, elapsed)
 
-def memdb_set(path: str, text: str, mtime: float | None):
-    if _MEM_DB_CONN is None:
-        init_mem_db()
     try:
-        cur = _MEM_DB_CONN.cursor()
-        cur.execute('REPLACE INTO mem_cache (path, text, mtime) VALUES (?,?,?)', (path, text, mtime))
-        _MEM_DB_CONN.commit()
-    except Exception:
-        pass
+        if workers <= 1 or total < 2:
+            for p in todo:
+                handle(scan_file(p))
+        else:
+            # 控制在途任务数量，避免结果堆积占用内存
+            max_in_flight = workers * 4
+            it = iter(todo)
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                futures = set()
+                for p in it:
+                    futures.add(ex.submit(scan_file, p))
+                    if len(futures) >= max_in_flight:
+                        break
+                while futures:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        handle(fut.result())
+                        nxt = next(it, None)
+                        if nxt is not None:
+                            futures.add(ex.submit(scan_file, nxt))
+        if pending:
+            write_records(conn, pending)
+            conn.commit()
+            ok += len(pending)
+            pending.clear()
+    finally:
+        index_progress.update(running=False, elapsed=time.time() - start)
+    if progress and total:
+        print()
+    return ok, failed, skipped
 
 
-def memdb_get(path: str):
-    if _MEM_DB_CONN is None:
-        init_mem_db()
+def _stat_key(path_str):
     try:
-        cur = _MEM_DB_CONN.cursor()
-        cur.execute('SELECT text, mtime FROM mem_cache WHERE path = ?', (path,))
-        row = cur.fetchone()
-        if row:
-            return row[0], row[1]
-    except Exception:
-        pass
-    return None, None
+        st = os.stat(path_str)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _walk_files(root: Path, suffix: str):
+    """单次遍历目录树，返回 {绝对路径: (mtime, size)}"""
+    found = {}
+    stack = [str(root)]
+    while stack:
+        d = stack.pop()
+        try:
+            entries = list(os.scandir(d))
+        except OSError:
+            continue
+        for e in entries:
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                elif e.name.lower().endswith(suffix) and e.is_file():
+                    st = e.stat()
+                    found[e.path] = (st.st_mtime, st.st_size)
+            except OSError:
+                continue
+    return found
+
+
+def sync_directory(root: Path, suffix: str = '.txt', workers=None, progress=print_progress):
+    """
+    增量同步目录：只重新索引新增或 mtime/size 变化的文件，并删除库中已不存在的文件。
+    返回 (更新数, 失败数, 删除数, 未变化数)
+    """
+    root = root.resolve()
+    local = _walk_files(root, suffix)
+    prefix = os.path.join(str(root), '')
+    conn = get_db()
+    # 路径范围查询走 path 上的唯一索引
+    cur = conn.execute('SELECT id, path, mtime, size FROM novels WHERE path >= ? AND path < ?', (prefix, prefix + '\U0010ffff'))
+    db_rows = {r[1]: (r[0], r[2], r[3]) for r in cur.fetchall()}
+    to_delete = [nid for path, (nid, _, _) in db_rows.items() if path not in local]
+    for i in range(0, len(to_delete), 900):
+        chunk = to_delete[i:i + 900]
+        conn.execute(f"DELETE FROM novels WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+    conn.commit()
+    changed = [p for p, key in local.items() if p not in db_rows or db_rows[p][1:] != key]
+    ok, failed, _ = index_files(changed, workers=workers, progress=progress)
+    return ok, failed, len(to_delete), len(local) - len(changed)
 
 
 def index_file(file_path: Path):
     if not file_path.exists() or not file_path.is_file():
         return False, 'file not found'
     conn = get_db()
-    cur = conn.execute('SELECT 1 FROM novels WHERE path = ?', (str(file_path.resolve()),))
-    is_already_indexed = cur.fetchone() is not None
-    if is_already_indexed:
-        conn.close()
+    cur = conn.execute('SELECT mtime, size FROM novels WHERE path = ?', (str(file_path.resolve()),))
+    row = cur.fetchone()
+    if row is not None and (row[0], row[1]) == _stat_key(str(file_path)):
         return False, 'file already indexed'
-
-    try:
-        text = read_text_with_encoding(file_path)
-    except Exception as e:
-        return False, f'read error: {e}'
-    first100 = ' '.join(text.strip().split())[:100]
-    size = None
-    try:
-        size = file_path.stat().st_size
-    except Exception:
-        size = None
-    chars = len(text)
-    conn = get_db()
-    conn.execute(
-        'REPLACE INTO novels (filename, path, first100, added_at, size, chars) VALUES (?,?,?,?,?,?)',
-        (file_path.name, str(file_path.resolve()), first100, datetime.datetime.utcnow().isoformat(), size, chars)
-    )
+    rec = scan_file(str(file_path.resolve()))
+    if 'error' in rec:
+        return False, f"read error: {rec['error']}"
+    write_records(conn, [rec])
     conn.commit()
-    conn.close()
-    # cache into mem sqlite
-    try:
-        memdb_set(str(file_path.resolve()), text, file_path.stat().st_mtime)
-    except Exception:
-        pass
     return True, None
@@ -1,36 +1,111 @@
 import csv
+import threading
 from pathlib import Path
 from datetime import datetime
 
+import utils_read_record
+
 RECORD_DIR = Path(__file__).parent / 'records'
 RECORD_DIR.mkdir(exist_ok=True)
 MARK_FILE = RECORD_DIR / 'mark.csv'
 
+_init_lock = threading.Lock()
+_initialized = False
+# 已用 tag 的缓存，写入评分时失效
+_tags_cache = None
+
+
+def _init_db(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS marks (
+        user TEXT NOT NULL,
+        novel_id INTEGER NOT NULL,
+        filename TEXT,
+        path TEXT,
+        score INTEGER,
+        tag TEXT,
+        marked_at TEXT,
+        PRIMARY KEY (user, novel_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_marks_tag ON marks(tag)')
+    migrated = conn.execute("SELECT 1 FROM meta WHERE key = 'mark_csv_migrated'").fetchone()
+    if not migrated:
+        # 一次性按时间顺序回放 mark.csv，后写的覆盖先写的
+        rows = []
+        if MARK_FILE.exists():
+            with MARK_FILE.open('r', encoding='utf-8', newline='') as f:
+                for row in csv.reader(f):
+                    if len(row) >= 6:
+                        try:
+                            rows.append((row[1], int(row[2]), row[3], row[4], int(row[5]), row[6] if len(row) > 6 else '', row[0]))
+                        except ValueError:
+                            continue
+        conn.executemany(
+            'INSERT OR REPLACE INTO marks (user, novel_id, filename, path, score, tag, marked_at) VALUES (?,?,?,?,?,?,?)',
+            rows
+        )
+        conn.execute("INSERT INTO meta (key, value) VALUES ('mark_csv_migrated', ?)", (datetime.now().isoformat(),))
+    conn.commit()
+
+
+def _get_conn():
+    global _initialized
+    conn = utils_read_record.get_records_db()
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                _init_db(conn)
+                _initialized = True
+    return conn
+
+
 def write_mark(user, novel_id, filename, path, score, tag=None):
+    global _tags_cache
+    now = datetime.now().isoformat()
+    # mark.csv 仍保留为追加式历史（tag_movefile.py 依赖它）
     with MARK_FILE.open('a', encoding='utf-8', newline='') as f:
         writer = csv.writer(f)
         writer.writerow([
-            datetime.now().isoformat(), user, novel_id, filename, path, score, tag or ''
+            now, user, novel_id, filename, path, score, tag or ''
         ])
+    conn = _get_conn()
+    conn.execute(
+        'INSERT OR REPLACE INTO marks (user, novel_id, filename, path, score, tag, marked_at) VALUES (?,?,?,?,?,?,?)',
+        (user, int(novel_id), filename, path, int(score), tag or '', now)
+    )
+    conn.commit()
+    _tags_cache = None
 
 def get_mark(user, novel_id):
-    if not MARK_FILE.exists():
+    row = _get_conn().execute(
+        'SELECT score, tag FROM marks WHERE user = ? AND novel_id = ?', (user, int(novel_id))
+    ).fetchone()
+    if row is None:
         return None
-    with MARK_FILE.open('r', encoding='utf-8', newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if len(row) >= 6 and row[1] == user and row[2] == str(novel_id):
-                return {'score': row[5], 'tag': row[6] if len(row) > 6 else ''}
-    return None
+    return {'score': str(row[0]), 'tag': row[1] or ''}
+
+# 批量获取评分：一次查询返回 {novel_id: mark}
+def get_marks(user, novel_ids):
+    ids = [int(i) for i in novel_ids]
+    marks = {}
+    for i in range(0, len(ids), 900):
+        chunk = ids[i:i + 900]
+        placeholders = ','.join('?' * len(chunk))
+        cur = _get_conn().execute(
+            f'SELECT novel_id, score, tag FROM marks WHERE user = ? AND novel_id IN ({placeholders})',
+            [user] + chunk
+        )
+        for nid, score, tag in cur:
+            marks[nid] = {'score': str(score), 'tag': tag or ''}
+    return marks
 
 # 获取所有已用 tag 列表
 def get_all_tags():
-    tags = set()
-    if not MARK_FILE.exists():
-        return []
-    with MARK_FILE.open('r', encoding='utf-8', newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if len(row) > 6 and row[6].strip():
-                tags.add(row[6].strip())
-    return sorted(tags)
+    global _tags_cache
+    tags = _tags_cache
+    if tags is None:
+        cur = _get_conn().execute("SELECT DISTINCT tag FROM marks WHERE tag != ''")
+        tags = sorted({r[0].strip() for r in cur if r[0].strip()})
+        _tags_cache = tags
+    return tags
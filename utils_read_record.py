@@ -1,55 +1,229 @@
+import atexit
 import csv
+import queue
+import threading
+import time
 from pathlib import Path
 from datetime import datetime
 
+import utils
+
 RECORD_DIR = Path(__file__).parent / 'records'
 RECORD_DIR.mkdir(exist_ok=True)
 
 LOG_FILE = RECORD_DIR / 'read_log.csv'
 NODE_FILE = RECORD_DIR / 'read_node.csv'
+DB_FILE = RECORD_DIR / 'records.db'
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _init_db(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS read_node (
+        user TEXT NOT NULL,
+        novel_id INTEGER NOT NULL,
+        chapter_idx INTEGER,
+        page_num INTEGER,
+        updated_at TEXT,
+        PRIMARY KEY (user, novel_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    migrated = conn.execute("SELECT 1 FROM meta WHERE key = 'read_node_csv_migrated'").fetchone()
+    if not migrated:
+        # 一次性迁移旧的 read_node.csv（保留原文件作备份）
+        rows = []
+        if NODE_FILE.exists():
+            with NODE_FILE.open('r', encoding='utf-8', newline='') as f:
+                for row in csv.reader(f):
+                    if len(row) >= 5:
+                        try:
+                            rows.append((row[1], int(row[2]), int(row[3]), int(row[4]), row[0]))
+                        except ValueError:
+                            continue
+        conn.executemany(
+            'INSERT OR REPLACE INTO read_node (user, novel_id, chapter_idx, page_num, updated_at) VALUES (?,?,?,?,?)',
+            rows
+        )
+        conn.execute("INSERT INTO meta (key, value) VALUES ('read_node_csv_migrated', ?)", (datetime.now().isoformat(),))
+    conn.commit()
+
+
+def get_records_db():
+    # 走 utils 的连接管理（每线程复用、WAL）；首次使用时建表并迁移旧数据
+    global _initialized
+    conn = utils.get_db(DB_FILE)
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                _init_db(conn)
+                _initialized = True
+    return conn
+
+# 后台写入：阅读日志与进度先进入有界队列，由单独线程批量落盘，不占用请求线程
+WRITE_BEHIND_QUEUE_SIZE = 10000
+WRITE_BEHIND_BATCH = 200
+WRITE_BEHIND_INTERVAL = 1.0  # 秒
+
+
+class RecordWriter(threading.Thread):
+    def __init__(self, maxsize=WRITE_BEHIND_QUEUE_SIZE, batch=WRITE_BEHIND_BATCH, interval=WRITE_BEHIND_INTERVAL):
+        super().__init__(name='record-writer', daemon=True)
+        self.queue = queue.Queue(maxsize)
+        self.batch = batch
+        self.interval = interval
+        self._lock = threading.Lock()
+        # 同一 (user, novel_id) 的节点/进度只保留最新一条
+        self._nodes = {}
+        self._progress = {}
+        self._logs = []
+        # 正在写盘的节点，写完前 get_read_node 仍能读到
+        self._flushing = {}
+        self._stopped = False
+
+    def put_log(self, row):
+        self.queue.put(('log', row))
+
+    def put_node(self, key, node_row, progress_row=None):
+        with self._lock:
+            self._nodes[key] = node_row
+        self.queue.put(('progress', (key, progress_row)))
+
+    def pending_node(self, key):
+        with self._lock:
+            return self._nodes.get(key) or self._flushing.get(key)
+
+    def flush(self, timeout=None):
+        """等待当前队列中的记录全部落盘"""
+        if not self.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put(('flush', done))
+        done.wait(timeout)
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        if self.is_alive():
+            self.queue.put(('stop', None))
+            self.join()
+
+    def run(self):
+        last_flush = time.monotonic()
+        count = 0
+        waiters = []
+        running = True
+        while running:
+            timeout = max(self.interval - (time.monotonic() - last_flush), 0.01)
+            try:
+                kind, item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, item = None, None
+            if kind == 'log':
+                self._logs.append(item)
+                count += 1
+            elif kind == 'progress':
+                key, row = item
+                if row is not None:
+                    self._progress[key] = row
+                count += 1
+            elif kind == 'flush':
+                waiters.append(item)
+            elif kind == 'stop':
+                running = False
+            if count >= self.batch or waiters or not running or time.monotonic() - last_flush >= self.interval:
+                if count:
+                    try:
+                        self._write()
+                    except Exception as e:
+                        print(f'阅读记录写入失败: {e}')
+                count = 0
+                last_flush = time.monotonic()
+                for w in waiters:
+                    w.set()
+                waiters = []
+
+    def _write(self):
+        with self._lock:
+            nodes, self._nodes = self._nodes, {}
+            self._flushing = nodes
+        logs, self._logs = self._logs, []
+        progress, self._progress = self._progress, {}
+        try:
+            if nodes:
+                conn = get_records_db()
+                conn.executemany(
+                    'INSERT INTO read_node (user, novel_id, chapter_idx, page_num, updated_at) VALUES (?,?,?,?,?) '
+                    'ON CONFLICT(user, novel_id) DO UPDATE SET chapter_idx = excluded.chapter_idx, '
+                    'page_num = excluded.page_num, updated_at = excluded.updated_at',
+                    list(nodes.values())
+                )
+                conn.commit()
+            if logs:
+                with LOG_FILE.open('a', encoding='utf-8', newline='') as f:
+                    csv.writer(f).writerows(logs)
+            if progress:
+                with PROGRESS_FILE.open('a', encoding='utf-8', newline='') as f:
+                    csv.writer(f).writerows(progress.values())
+        finally:
+            with self._lock:
+                self._flushing = {}
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = RecordWriter()
+                _writer.start()
+                atexit.register(_writer.stop)
+    return _writer
 
 # 写入阅读日志（追加）
 def write_read_log(user, novel_id, chapter_idx, page_num):
-    with LOG_FILE.open('a', encoding='utf-8', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            datetime.now().isoformat(), user, novel_id, chapter_idx, page_num
-        ])
+    get_writer().put_log([
+        datetime.now().isoformat(), user, novel_id, chapter_idx, page_num
+    ])
 
 PROGRESS_FILE = RECORD_DIR / 'read_progress.csv'
 
-# 写入最新节点（覆盖）
+# 写入最新节点（按 (user, novel_id) 覆盖）
 def write_read_node(user, novel_id, chapter_idx, page_num, filename=None, total_chars=None, percent=None):
-    nodes = {}
-    if NODE_FILE.exists():
-        with NODE_FILE.open('r', encoding='utf-8', newline='') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) >= 5:
-                    nodes[(row[1], row[2])] = row
-    nodes[(user, str(novel_id))] = [datetime.now().isoformat(), user, str(novel_id), str(chapter_idx), str(page_num)]
-    with NODE_FILE.open('w', encoding='utf-8', newline='') as f:
-        writer = csv.writer(f)
-        for v in nodes.values():
-            writer.writerow(v)
+    now = datetime.now().isoformat()
+    progress_row = None
     # 记录进度到 read_progress.csv
     if filename is not None and total_chars is not None and percent is not None:
-        with PROGRESS_FILE.open('a', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                datetime.now().isoformat(), user, novel_id, filename, total_chars, percent
-            ])
+        progress_row = [now, user, novel_id, filename, total_chars, percent]
+    get_writer().put_node(
+        (user, int(novel_id)),
+        (user, int(novel_id), int(chapter_idx), int(page_num), now),
+        progress_row
+    )
 
 # 读取最新节点
 def get_read_node(user, novel_id):
-    if not NODE_FILE.exists():
+    node = _writer.pending_node((user, int(novel_id))) if _writer is not None else None
+    if node is not None:
+        return {
+            'chapter_idx': node[2],
+            'page_num': node[3]
+        }
+    conn = get_records_db()
+    row = conn.execute(
+        'SELECT chapter_idx, page_num FROM read_node WHERE user = ? AND novel_id = ?',
+        (user, int(novel_id))
+    ).fetchone()
+    if row is None:
         return None
-    with NODE_FILE.open('r', encoding='utf-8', newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if len(row) >= 5 and row[1] == user and row[2] == str(novel_id):
-                return {
-                    'chapter_idx': int(row[3]),
-                    'page_num': int(row[4])
-                }
-    return None
+    return {
+        'chapter_idx': row[0],
+        'page_num': row[1]
+    }
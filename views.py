@@ -1,17 +1,17 @@
-from flask import send_file, Response
+from flask import Response
 import re
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, jsonify
 import services
+import update_db_fields
 import os
 import utils
-from pathlib import Path
 
 bp = Blueprint('main', __name__)
 import re
 import urllib.parse
 from flask import Response
 
-def text_attachment_response(full_text: str, title: str):
+def text_attachment_response(full_text, title: str, content_length=None):
     # 清理标题（防止极端情况）
     clean_title = re.sub(r'[/\\:*?"<>|\r\n\t]', '_', title)[:150]
     if not clean_title.strip(' _'):
@@ -26,37 +26,22 @@ def text_attachment_response(full_text: str, title: str):
     encoded = urllib.parse.quote(utf8_filename, safe='')
 
     disposition = f'attachment; filename="{ascii_filename}"; filename*=UTF-8\'\'{encoded}'
+    headers = {'Content-Disposition': disposition}
+    if content_length is not None:
+        headers['Content-Length'] = str(content_length)
 
     return Response(
         full_text,
         mimetype='text/plain; charset=utf-8',
-        headers={'Content-Disposition': disposition}
+        headers=headers
     )
-# 全文下载路由
+# 全文下载路由（按章节流式输出，不在内存里拼接全文）
 @bp.route('/download_full/<int:novel_id>')
 def download_full(novel_id):
-    title, page_text, chapters, current_chapter, page, total_pages, node = services.get_novel_page(novel_id, None, None, user='default')
-    if title is None or not chapters:
+    title, chunks, length = services.iter_novel_text(novel_id)
+    if title is None:
         abort(404)
-    # 获取全文内容
-    from utils import read_chapter_text
-    full_text = ''
-    for idx, chap in enumerate(chapters):
-        full_text += chap['title'] + '\n'
-        if idx == 0:
-            full_text += (page_text or '') + '\n'
-        else:
-            full_text += read_chapter_text(novel_id, chap['start'], chap['end']) + '\n'
-    # 文件名安全处理
-    return text_attachment_response(full_text, title)
-
-
-
-
-
-
-
-
+    return text_attachment_response(chunks, title, content_length=length)
 
 
 @bp.route('/download/<int:novel_id>/<int:chapter_idx>')
@@ -76,9 +61,12 @@ def download_chapter(novel_id, chapter_idx):
 
 @bp.route('/')
 def home():
-    page = request.args.get('page', 1, type=int)
     page_size = 20
-    novels, total = services.list_novels(page=page, page_size=page_size, with_total=True)
+    after = request.args.get('after') or None
+    before = request.args.get('before') or None
+    novels, next_cursor, prev_cursor = services.list_novels(page_size=page_size, after=after, before=before)
+    total = services.count_novels()
+    marks = services.get_novel_marks('default', [n['id'] for n in novels])
     # 尝试读取书源定义 JSON 文件并传入模板供前端编辑
     frontend_json = '[]'
     try:
@@ -88,7 +76,24 @@ def home():
     except Exception:
         # 保持默认空数组字符串
         pass
-    return render_template('index.html', novels=novels, total=total, page=page, page_size=page_size, frontend_json=frontend_json)
+    return render_template('index.html', novels=novels, marks=marks, total=total,
+                           next_cursor=next_cursor, prev_cursor=prev_cursor, frontend_json=frontend_json)
+
+
+@bp.route('/api/novels')
+def api_novels():
+    page_size = min(max(request.args.get('page_size', 20, type=int), 1), 200)
+    novels, next_cursor, prev_cursor = services.list_novels(
+        page_size=page_size,
+        after=request.args.get('after') or None,
+        before=request.args.get('before') or None,
+    )
+    return jsonify({
+        'novels': [dict(n) for n in novels],
+        'next': next_cursor,
+        'prev': prev_cursor,
+        'total': services.count_novels(),
+    })
 
 @bp.route('/mark/<int:novel_id>', methods=['POST'])
 def mark_novel(novel_id):
@@ -117,46 +122,37 @@ def index_route():
     return redirect(url_for('main.home'))
 
 
+@bp.route('/index/progress')
+def index_progress():
+    return jsonify(utils.index_progress)
+
+
 @bp.route('/search')
 def search():
     q = request.args.get('q', '').strip()
     mode = request.args.get('mode', 'all')
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = 50
     # 默认全部搜索
     if mode == 'filename':
-        rows = services.search_novels(q, '')
+        rows, total = services.search_novels(q, '', page=page, page_size=page_size, with_total=True)
     elif mode == 'text':
-        rows = services.search_novels('', q)
+        rows, total = services.search_novels('', q, page=page, page_size=page_size, with_total=True)
     else:
-        rows = services.search_novels(q, q)
-
-    # 为每个搜索结果计算字数（字符数），使用内存缓存以减少磁盘I/O
-    results = []
-    for row in rows:
-        d = dict(row)
-        # prefer stored chars and size from DB, fallback to reading file
-        try:
-            if d.get('chars') is None:
-                p = Path(d.get('path') or '')
-                if p.exists():
-                    content = utils.read_text_with_encoding(p)
-                    d['chars'] = len(content)
-                    try:
-                        utils.memdb_set(str(p.resolve()), content, p.stat().st_mtime)
-                    except Exception:
-                        pass
-                else:
-                    d['chars'] = 0
-        except Exception:
-            d['chars'] = d.get('chars') or 0
-        try:
-            if d.get('size') is None:
-                p = Path(d.get('path') or '')
-                d['size'] = p.stat().st_size if p.exists() else 0
-        except Exception:
-            d['size'] = d.get('size') or 0
-        results.append(d)
-
-    return render_template('search.html', results=results, q=q, mode=mode)
+        rows, total = services.search_novels(q, q, page=page, page_size=page_size, with_total=True)
+
+    # 字数/大小缺失的行交给后台补全，本次直接显示“未知”
+    missing = [row for row in rows if row['chars'] is None or row['size'] is None]
+    if missing:
+        update_db_fields.enqueue_backfill(missing)
+    results = [dict(row) for row in rows]
+
+    return render_template('search.html', results=results, q=q, mode=mode, page=page, page_size=page_size, total=total)
+
+
+@bp.route('/cache/stats')
+def cache_stats():
+    return jsonify(utils.text_cache.stats())
 
 
 @bp.route('/reader/<int:novel_id>')
@@ -194,32 +190,19 @@ def reader_by_filename(filename):
     支持 URL 传参，例如: /reader/name/我的小说.txt?chapter=5
     """
     filename = filename.strip()
-    
-    # 使用现有的搜索服务查找文件名
-    # 对应 search 路由中 mode == 'filename' 的逻辑
-    rows = services.search_novels(filename, '')
-    
-    target_id = None
-    
-    # 策略 1: 尝试精确匹配 (防止搜索 "斗破" 匹配到 "斗破苍穹续集" 而不是本体)
-    for row in rows:
-        d = dict(row)
-        # 假设数据库返回字段中有 title 或 filename (根据你的 search 路由推断)
-        # 这里的 .name 属性取决于你 row 对象的具体结构，如果是字典则用 d.get('title')
-        db_name = d.get('title') or d.get('filename') or ''
-        
-        if db_name == filename:
-            target_id = d.get('id')
-            break
-            
-    # 策略 2: 如果没有精确匹配，但有搜索结果，默认取第一个
-    if target_id is None and rows:
-        first_row = dict(rows[0])
-        target_id = first_row.get('id')
+
+    # 策略 1: 精确匹配（归一化文件名，带不带扩展名均可）
+    target_id = services.find_novel_by_name(filename)
+
+    # 策略 2: 精确匹配不到时才走模糊搜索，取排名第一的结果
+    if target_id is None:
+        rows = services.search_novels(filename, '', page_size=1)
+        if rows:
+            target_id = rows[0]['id']
 
     if target_id:
         # 构建重定向 URL，并保留原有的查询参数 (如 chapter, xqy 等)
         # url_for('.reader') 这里的 . 代表当前 blueprint
         return redirect(url_for('.reader', novel_id=target_id, **request.args))
     else:
-        return abort(404, description=f"未找到名为 '{filename}' 的小说")
\ No newline at end of file
+        return abort(404, description=f"未找到名为 '{filename}' 的小说")
@@ -0,0 +1,231 @@
+"""
+FAISS 索引构建与查询参数（index.py、app.py 和基准脚本共用）
+
+配置项（写在 CONFIG_LIST 的每个条目里，均可省略）:
+    index_type       flat | ivf_flat | hnsw | ivf_pq | sq_fp16 | sq8 | pq，默认 flat
+                     sq_fp16 / sq8 为标量量化（每维 2 / 1 字节，内存为 flat 的 1/2、1/4），pq 为乘积量化（每向量 pq_m 字节）
+    nlist            IVF 聚类中心数，默认按 4*sqrt(N) 估算
+    nprobe           IVF 默认查询的聚类数，默认 16
+    pq_m             PQ / IVF-PQ 子向量个数（需整除维度），默认 64
+    pq_nbits         PQ / IVF-PQ 每个子向量的编码位数，默认 8
+    hnsw_m           HNSW 每个节点的邻居数，默认 32
+    ef_construction  HNSW 建图时的候选数，默认 200
+    ef_search        HNSW 默认查询候选数，默认 64
+    train_size       训练 IVF/PQ 时的采样数，默认 50000
+    chunk_index_path 章节块索引文件，默认在 index_path 的文件名后加 _chunks
+    embedding_dtype  数据库里向量 BLOB 的存储格式 float32 | float16 | int8，默认 float32
+"""
+import math
+import os
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq', 'sq_fp16', 'sq8', 'pq')
+SQ_TYPES = {
+    'sq_fp16': faiss.ScalarQuantizer.QT_fp16,
+    'sq8': faiss.ScalarQuantizer.QT_8bit,
+}
+
+EMBEDDING_DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+INT8_SCALE = 127.0  # 归一化向量各分量在 [-1, 1]，线性映射到 int8
+
+# 只读加载时 mmap 索引文件：向量 / 倒排表按需从页缓存调入，多个进程共享同一份物理内存
+# IO_FLAG_MMAP_IFC 覆盖 flat / SQ / PQ 编码和 IVF 倒排表；旧版本 faiss 只有 IO_FLAG_MMAP（仅 IVF 倒排表）
+MMAP_FLAG = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+
+
+def encode_embedding(vec, dtype='float32'):
+    """归一化向量 -> 数据库 BLOB"""
+    vec = np.asarray(vec, dtype=np.float32)
+    if dtype == 'float16':
+        return vec.astype(np.float16).tobytes()
+    if dtype == 'int8':
+        return np.clip(np.rint(vec * INT8_SCALE), -127, 127).astype(np.int8).tobytes()
+    return vec.tobytes()
+
+
+def decode_embeddings(blobs, dtype='float32'):
+    """数据库 BLOB 列表 -> (n, d) float32 矩阵；有损格式解码后重新归一化"""
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+    arr = np.frombuffer(b''.join(blobs), dtype=EMBEDDING_DTYPES[dtype]).reshape(len(blobs), -1)
+    arr = arr.astype(np.float32)
+    if dtype != 'float32':
+        faiss.normalize_L2(arr)
+    return arr
+
+
+def _train_sample(vectors, train_size, seed=0):
+    if len(vectors) <= train_size:
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[rng.choice(len(vectors), train_size, replace=False)]
+
+
+def build_base_index(vectors, config):
+    """按配置创建（并在需要时训练）底层索引，不含向量"""
+    n, d = vectors.shape
+    index_type = config.get('index_type', 'flat')
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f'未知索引类型: {index_type}')
+
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, config.get('hnsw_m', 32), faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config.get('ef_construction', 200)
+        index.hnsw.efSearch = config.get('ef_search', 64)
+        return index
+
+    if index_type in SQ_TYPES:
+        index = faiss.IndexScalarQuantizer(d, SQ_TYPES[index_type], faiss.METRIC_INNER_PRODUCT)
+        index.train(_train_sample(vectors, config.get('train_size', 50000)))
+        return index
+
+    if index_type == 'pq':
+        if n < 2 ** config.get('pq_nbits', 8):
+            print(f'提示: 数据量 {n} 太少，无法训练 pq，改用 flat')
+            return faiss.IndexFlatIP(d)
+        index = faiss.IndexPQ(d, config.get('pq_m', 64), config.get('pq_nbits', 8), faiss.METRIC_INNER_PRODUCT)
+        index.train(_train_sample(vectors, config.get('train_size', 50000)))
+        return index
+
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = config.get('nlist') or int(4 * math.sqrt(n))
+        # 每个聚类至少需要约 39 个训练样本，数据太少时退回暴力检索
+        nlist = min(nlist, n // 39)
+        if nlist < 1 or (index_type == 'ivf_pq' and n < 2 ** config.get('pq_nbits', 8)):
+            print(f'提示: 数据量 {n} 太少，无法训练 {index_type}，改用 flat')
+            return faiss.IndexFlatIP(d)
+        quantizer = faiss.IndexFlatIP(d)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, config.get('pq_m', 64), config.get('pq_nbits', 8),
+                                     faiss.METRIC_INNER_PRODUCT)
+        index.train(_train_sample(vectors, config.get('train_size', 50000)))
+        index.nprobe = config.get('nprobe', 16)
+        return index
+
+    return faiss.IndexFlatIP(d)
+
+
+def build_index(vectors, ids, config):
+    """
+    构建带自定义 id 的索引，vectors 需已归一化
+    IVF 的倒排表直接存外部 id，不套 IndexIDMap：套上后 remove_ids 会压缩 id_map，
+    倒排表里的顺序号却不变，增删一次后 id 就全对不上；其他类型用 IndexIDMap 包装
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = build_base_index(vectors, config)
+    if not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap(index)
+    index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def chunk_index_path(config):
+    """章节块索引（chunk_mode=chapter）的文件路径"""
+    if config.get('chunk_index_path'):
+        return config['chunk_index_path']
+    root, ext = os.path.splitext(config['index_path'])
+    return f"{root}_chunks{ext}"
+
+
+def read_index(path, mmap=True):
+    """读取索引；mmap=True 时优先映射文件，不支持的索引类型退回整体读入内存"""
+    if mmap:
+        try:
+            return faiss.read_index(path, MMAP_FLAG)
+        except RuntimeError as e:
+            print(f"mmap 加载失败，改为读入内存 {path}: {e}")
+    return faiss.read_index(path)
+
+
+def write_index(index, path):
+    """先写临时文件再 os.replace 原子替换
+
+    正在使用（或 mmap 着）旧文件的进程继续读旧文件，不会读到写了一半的索引
+    """
+    tmp = f"{path}.tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
+
+
+def supports_incremental(index):
+    """能否直接 add_with_ids / remove_ids：IndexIDMap（非 IVF）或不带包装的 IVF；旧版本套了 IndexIDMap 的 IVF 不行"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return not isinstance(base_index(index), faiss.IndexIVF)
+    return isinstance(faiss.downcast_index(index), faiss.IndexIVF)
+
+
+def index_ids(index):
+    """索引中全部向量的外部 id：IndexIDMap 读 id_map，IVF 逐个读倒排表"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map)
+    invlists = faiss.extract_index_ivf(index).invlists
+    parts = []
+    for list_no in range(invlists.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ptr = invlists.get_ids(list_no)
+            parts.append(faiss.rev_swig_ptr(ptr, size).copy())
+            invlists.release_ids(list_no, ptr)
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+def base_index(index):
+    """取出 IndexIDMap 包装下的实际索引"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return faiss.downcast_index(index)
+
+
+def index_kind(index):
+    base = base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(base, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(base, faiss.IndexIVF):
+        return 'ivf_flat'
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        for name, qtype in SQ_TYPES.items():
+            if base.sq.qtype == qtype:
+                return name
+    if isinstance(base, faiss.IndexPQ):
+        return 'pq'
+    return 'flat'
+
+
+def search_params(index, nprobe=None, ef_search=None, sel=None):
+    """按索引类型生成单次查询参数；不修改共享索引对象，多线程查询互不影响
+
+    sel 为 faiss.IDSelector 时只在被选中的 id 里检索（过滤条件下推到向量检索）
+    """
+    kind = index_kind(index)
+    if kind == 'pq' and sel is not None:
+        raise ValueError('IndexPQ 不支持 IDSelector，过滤检索请先用 filter_search 决定候选数')
+    if kind in ('ivf_flat', 'ivf_pq') and (nprobe or sel is not None):
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe or base_index(index).nprobe))
+    elif kind == 'hnsw' and (ef_search or sel is not None):
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search or base_index(index).hnsw.efSearch))
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+    return params
+
+
+def filter_search(index, selected_ids, k):
+    """
+    过滤检索用的 (IDSelector, 候选数)；selected_ids 为 None 表示不过滤
+    IndexPQ 不支持 IDSelector，改为按通过比例放大候选数，由调用方检索后再按掩码过滤
+    """
+    if selected_ids is None:
+        return None, k
+    if index_kind(index) != 'pq':
+        return faiss.IDSelectorBatch(selected_ids), k
+    ratio = len(selected_ids) / max(index.ntotal, 1)
+    return None, int(min(k / max(ratio, 1e-3), max(index.ntotal, k)))
@@ -1,13 +1,17 @@
 import os
 import time
+import threading
 import sqlite3
-import faiss
 import numpy as np
 import datetime
-import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from flask import Flask, render_template, request, jsonify
 from sentence_transformers import SentenceTransformer
 
+import ann_index
+import doc_meta
+import query_encoder
+
 # --- 修复报错的关键设置 ---
 # 禁用 PyTorch Dynamo 编译优化，解决退出时的 "dump_compile_times" 报错
 os.environ["TORCH_COMPILE_DISABLE"] = "1"
@@ -18,6 +22,8 @@ os.environ["ANOMALY_DETECTION_NO_TRACEBACK"] = "1"
 MODEL_NAME = "BAAI/bge-small-zh-v1.5"
 MODEL_NAME = "./bge_model"
 # --- 配置 ---
+# 索引端开启 chunk_mode=chapter 的库会多一个章节块索引（index_path 后加 _chunks），存在即自动加载；
+# "chunk_agg": "sum" 可让多个章节都相关的书排在前面（默认 "max"，按最相关的一处排序）
 CONFIG_LIST = [
     {
         "name": "Local_Novels",
@@ -41,156 +47,264 @@ CONFIG_LIST = [
 
 
 
+# 候选池：先拿出足够多的数据(例如1000条)，才能保证排序后的分页是准确的
+# 如果数据量巨大，这里的 top_k 可能需要调大，或者采用流式处理
+CANDIDATE_LIMIT = 1000
+CHUNK_CANDIDATE_LIMIT = 2000  # 一本书可能有多个章节命中，章节块候选多取一些
+# 单个库的检索超时（秒），可在 CONFIG_LIST 条目里用 "timeout" 覆盖；超时的库不计入本次结果
+LIBRARY_TIMEOUT = 2.0
+# 每隔多少秒检查一次索引文件是否被 index.py 重建 / 更新，有变化就热加载；0 表示只通过 /api/reload 手动触发
+RELOAD_INTERVAL = 30
+
+
 class SearchService:
     def __init__(self):
         print(">>> 正在加载模型...")
         self.model = SentenceTransformer(MODEL_NAME)
+        # 查询向量缓存 + 并发请求微批编码
+        self.encoder = query_encoder.QueryEncoder(self.model)
+        # 多库并行检索；超时的任务仍会占着线程跑完，所以线程数留足余量
+        self.pool = ThreadPoolExecutor(max_workers=len(CONFIG_LIST) * 4, thread_name_prefix='library-search')
+        # 每个库的资源字典只整体替换、不原地修改：查询开始时取一次 self.resources，
+        # 重新加载期间进行中的查询继续用旧索引跑完
         self.resources = {}
+        self._signatures = {}
+        self._reload_lock = threading.Lock()
         self.load_resources()
+        if RELOAD_INTERVAL:
+            threading.Thread(target=self._watch, name='index-watcher', daemon=True).start()
+
+    def _signature(self, config):
+        # index.py 先写数据库、最后原子替换索引文件，所以只看索引文件的修改时间和大小
+        sig = []
+        for path in (config['index_path'], ann_index.chunk_index_path(config)):
+            try:
+                st = os.stat(path)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        sig.append(os.path.exists(config['db_path']))
+        return tuple(sig)
+
+    def _load_library(self, config):
+        res = {"config": config, "index": None, "meta": None,
+               "chunk_index": None, "chunks": None, "available": False}
+        if os.path.exists(config['index_path']) and os.path.exists(config['db_path']):
+            try:
+                # mmap 加载：启动快，多个 worker 进程共享同一份索引内存
+                res["index"] = ann_index.read_index(config['index_path'])
+                # 排序 / 过滤用的字段一次性读成列数组，查询时不再逐条查库解析
+                res["meta"] = doc_meta.LibraryMeta.load(config['db_path'])
+                chunk_path = ann_index.chunk_index_path(config)
+                if os.path.exists(chunk_path):
+                    res["chunk_index"] = ann_index.read_index(chunk_path)
+                    res["chunks"] = doc_meta.ChunkMeta.load(config['db_path'])
+                res["available"] = True
+            except Exception as e:
+                print(f"资源加载失败 {config['key']}: {e}")
+        return res
+
+    def load_resources(self, force=False):
+        """加载（或重新加载）索引文件有变化的库，整体替换 self.resources，返回重新加载的 key 列表"""
+        with self._reload_lock:
+            resources = dict(self.resources)
+            reloaded = []
+            for config in CONFIG_LIST:
+                key = config['key']
+                sig = self._signature(config)
+                if not force and key in resources and self._signatures.get(key) == sig:
+                    continue
+                res = self._load_library(config)
+                if not res['available'] and resources.get(key, {}).get('available') and sig[0] and sig[-1]:
+                    # 文件还在但加载失败（损坏、正被其他工具改写）时先沿用旧索引，下次检查再试
+                    print(f"重新加载失败，继续使用旧索引 {key}")
+                    continue
+                resources[key] = res
+                self._signatures[key] = sig
+                reloaded.append(key)
+            self.resources = resources
+            return reloaded
+
+    def _watch(self):
+        while True:
+            time.sleep(RELOAD_INTERVAL)
+            try:
+                reloaded = self.load_resources()
+            except Exception as e:
+                print(f"索引热加载失败: {e}")
+                continue
+            if reloaded:
+                print(f">>> 已重新加载索引: {', '.join(reloaded)}")
 
-    def load_resources(self):
-        for config in CONFIG_LIST:
-            key = config['key']
-            res = {"config": config, "index": None, "available": False}
-            if os.path.exists(config['index_path']) and os.path.exists(config['db_path']):
-                try:
-                    res["index"] = faiss.read_index(config['index_path'])
-                    res["available"] = True
-                except Exception as e:
-                    print(f"资源加载失败 {key}: {e}")
-            self.resources[key] = res
-
-    def parse_video_meta(self, preview_text):
+    def fetch_page(self, res, doc_ids):
+        """只为最终一页的文档查库，返回 {id: (filepath, filename, preview)}"""
+        if not doc_ids:
+            return {}
+        with sqlite3.connect(res['config']['db_path']) as conn:
+            placeholders = ','.join('?' * len(doc_ids))
+            sql = f"SELECT id, filepath, filename, preview_content FROM documents WHERE id IN ({placeholders})"
+            return {row[0]: row[1:] for row in conn.execute(sql, doc_ids)}
+
+    def fetch_chunks(self, res, chunk_ids):
+        """当前页命中的章节块，返回 {id: (chapter_idx, title)}"""
+        if not chunk_ids:
+            return {}
+        with sqlite3.connect(res['config']['db_path']) as conn:
+            placeholders = ','.join('?' * len(chunk_ids))
+            sql = f"SELECT id, chapter_idx, title FROM chunks WHERE id IN ({placeholders})"
+            return {row[0]: row[1:] for row in conn.execute(sql, chunk_ids)}
+
+    def search_library(self, res, q_vec, min_score, nprobe=None, ef_search=None, filters=None):
         """
-        从描述文本中提取数值以便排序
-        文本示例: "Size: 50.20MB, Resolution: 1920x1080, Duration: 5m30s"
+        单个库：向量检索 -> 阈值过滤 -> 章节块聚合（向量化）
+        返回 ((LibraryMeta, 行号, 排序分, 最高分, 最佳章节块 id) 或 None, 耗时秒数)
         """
-        meta = {
-            "size_mb": 0.0,
-            "resolution_pixels": 0,
-            "duration_sec": 0
-        }
+        t0 = time.time()
+        return self._search_library(res, q_vec, min_score, nprobe, ef_search, filters), time.time() - t0
+
+    def _search_library(self, res, q_vec, min_score, nprobe, ef_search, filters):
+        index = res['index']
+        meta = res['meta']
+
+        chunks = res['chunks']
+
+        # 范围过滤（时长/大小/分辨率）下推到向量检索：只在符合条件的 id 中取候选
+        # （PQ 索引不支持 id 选择器，改为多取候选，由下面的掩码过滤）
+        mask = meta.filter_mask(filters)
+        selected = chunk_selected = None
+        if mask is not None:
+            if not mask.any():
+                return None
+            if not mask.all():
+                selected = meta.ids[mask]
+                if chunks is not None:
+                    chunk_selected = chunks.select(selected)
+
+        # FAISS 搜索（nprobe / ef_search 只对 IVF / HNSW 索引生效）
+        sel, k = ann_index.filter_search(index, selected, CANDIDATE_LIMIT)
+        params = ann_index.search_params(index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+        D, I = index.search(q_vec, k, params=params)
         
-        if not preview_text:
-            return meta
-
-        # 1. 提取大小 (MB)
-        size_match = re.search(r'Size:\s*([\d\.]+)MB', preview_text)
-        if size_match:
-            meta['size_mb'] = float(size_match.group(1))
-
-        # 2. 提取分辨率 (计算总像素)
-        res_match = re.search(r'Resolution:\s*(\d+)x(\d+)', preview_text)
-        if res_match:
-            w, h = int(res_match.group(1)), int(res_match.group(2))
-            meta['resolution_pixels'] = w * h
-
-        # 3. 提取时长 (转为秒)
-        dur_match = re.search(r'Duration:\s*(\d+)m(\d+)s', preview_text)
-        if dur_match:
-            mins, secs = int(dur_match.group(1)), int(dur_match.group(2))
-            meta['duration_sec'] = mins * 60 + secs
-            
-        return meta
+        # 过滤：只保留分数 >= min_score 的 ID
+        keep = (I[0] != -1) & (D[0] >= min_score)
+        hit_docs, hit_scores = I[0][keep], D[0][keep]
+        hit_chunks = np.full(len(hit_docs), -1, dtype=np.int64)
 
-    def search(self, query, target_keys, min_score=0.4, sort_by='score', page=1, page_size=20):
+        # 章节块：命中的块映射回所属文档，与文件级命中一起按文档聚合
+        if chunks is not None:
+            chunk_sel, chunk_k = ann_index.filter_search(res['chunk_index'], chunk_selected, CHUNK_CANDIDATE_LIMIT)
+            chunk_params = ann_index.search_params(res['chunk_index'], nprobe=nprobe, ef_search=ef_search, sel=chunk_sel)
+            CD, CI = res['chunk_index'].search(q_vec, chunk_k, params=chunk_params)
+            ckeep = (CI[0] != -1) & (CD[0] >= min_score)
+            cpos, cfound = chunks.lookup(CI[0][ckeep])
+            hit_docs = np.concatenate([hit_docs, chunks.doc[cpos]])
+            hit_scores = np.concatenate([hit_scores, CD[0][ckeep][cfound]])
+            hit_chunks = np.concatenate([hit_chunks, chunks.ids[cpos]])
+        doc_ids, rank, best, best_chunk = doc_meta.aggregate_hits(
+            hit_docs, hit_scores, hit_chunks, res['config'].get('chunk_agg', 'max')
+        )
+
+        # 只保留仍在库中的文档
+        pos, found = meta.lookup(doc_ids)
+        rank, best, best_chunk = rank[found], best[found], best_chunk[found]
+        if mask is not None:
+            ok = mask[pos]
+            pos, rank, best, best_chunk = pos[ok], rank[ok], best[ok], best_chunk[ok]
+        if not len(pos):
+            return None
+        return meta, pos, rank, best, best_chunk
+
+    def search(self, query, target_keys, min_score=0.4, sort_by='score', page=1, page_size=20,
+               nprobe=None, ef_search=None, filters=None):
         t_start = time.time()
         
-        # 1. 获取向量
-        q_vec = self.model.encode([query], normalize_embeddings=True)
-        
-        # 候选池：先拿出足够多的数据(例如1000条)，才能保证排序后的分页是准确的
-        # 如果数据量巨大，这里的 top_k 可能需要调大，或者采用流式处理
-        CANDIDATE_LIMIT = 1000 
+        # 1. 获取向量（翻页、重复查询命中缓存；并发请求合并编码）
+        q_vec = self.encoder.encode(query)
         
-        raw_candidates = []
-
-        # 2. 遍历库 -> 向量搜索 -> 阈值过滤
+        # 2. 各库并行检索（FAISS 检索时释放 GIL），每个库单独计时、单独超时
+        # 整个查询使用同一份资源快照，不受中途热加载影响
+        resources = self.resources
+        futures = []
         for key in target_keys:
-            if key not in self.resources or not self.resources[key]['available']:
+            if key not in resources or not resources[key]['available']:
                 continue
-            
-            res = self.resources[key]
-            index = res['index']
-            db_path = res['config']['db_path']
+            futures.append((key, time.time(), self.pool.submit(
+                self.search_library, resources[key], q_vec, min_score, nprobe, ef_search, filters
+            )))
 
-            # FAISS 搜索
-            D, I = index.search(q_vec, CANDIDATE_LIMIT)
-            
-            valid_ids = []
-            score_map = {}
-            
-            # 过滤：只保留分数 > min_score 的 ID
-            for rank, idx in enumerate(I[0]):
-                if idx != -1:
-                    score = float(D[0][rank])
-                    if score >= min_score:
-                        valid_ids.append(int(idx))
-                        score_map[int(idx)] = score
-            
-            if not valid_ids:
+        parts = []
+        part_keys = []
+        libraries = {}
+        for key, submitted, future in futures:
+            timeout = resources[key]['config'].get('timeout', LIBRARY_TIMEOUT)
+            try:
+                part, elapsed = future.result(timeout=max(submitted + timeout - time.time(), 0))
+            except FuturesTimeout:
+                # 超时的库不等待（检索仍在后台跑完），先返回其余库的结果
+                libraries[key] = {"status": "timeout", "ms": int(timeout * 1000), "hits": 0}
+                continue
+            except Exception as e:
+                print(f"检索失败 {key}: {e}")
+                libraries[key] = {"status": "error", "error": str(e), "ms": int((time.time() - submitted) * 1000), "hits": 0}
                 continue
+            libraries[key] = {"status": "ok", "ms": round(elapsed * 1000, 1), "hits": len(part[1]) if part else 0}
+            if part is not None:
+                parts.append(part)
+                part_keys.append(key)
 
-            # 查库
-            with sqlite3.connect(db_path) as conn:
-                placeholders = ','.join('?' * len(valid_ids))
-                sql = f"SELECT id, filepath, filename, preview_content, mtime, file_type FROM documents WHERE id IN ({placeholders})"
-                cursor = conn.execute(sql, valid_ids)
-                
-                for row in cursor:
-                    doc_id, fpath, fname, preview, mtime, ftype = row
-                    score = score_map.get(doc_id, 0)
-                    
-                    # 解析元数据 (如果是视频)
-                    meta_vals = self.parse_video_meta(preview) if ftype == 'video' else {"size_mb": 0, "resolution_pixels": 0, "duration_sec": 0}
-
-                    raw_candidates.append({
-                        "id": f"{key}_{doc_id}",
-                        "source": res['config']['name'],
-                        "filename": fname,
-                        "filepath": fpath,
-                        "preview": preview,
-                        "type": ftype,
-                        "mtime": mtime,
-                        "mtime_str": datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M'),
-                        "score": score,
-                        "score_percent": int(score * 100),
-                        # 排序用的数值字段
-                        "sort_size": meta_vals['size_mb'],
-                        "sort_res": meta_vals['resolution_pixels'],
-                        "sort_dur": meta_vals['duration_sec'],
-                        "external_url": fpath # 暂时直接返回路径，前端处理跳转
-                    })
-
-        # 3. 排序 (Sort)
-        # Python 的 sort 是稳定的 (Timsort)
-        reverse = True # 默认降序
-        
-        if sort_by == 'score':
-            raw_candidates.sort(key=lambda x: x['score'], reverse=True)
-        elif sort_by == 'date_desc':
-            raw_candidates.sort(key=lambda x: x['mtime'], reverse=True)
-        elif sort_by == 'date_asc':
-            raw_candidates.sort(key=lambda x: x['mtime'], reverse=False)
-        elif sort_by == 'size':
-            raw_candidates.sort(key=lambda x: x['sort_size'], reverse=True)
-        elif sort_by == 'duration':
-            raw_candidates.sort(key=lambda x: x['sort_dur'], reverse=True) # 长视频在前
-        elif sort_by == 'resolution':
-            raw_candidates.sort(key=lambda x: x['sort_res'], reverse=True) # 高清在前
-        elif sort_by == 'name':
-            raw_candidates.sort(key=lambda x: x['filename'], reverse=False) # A-Z
-
-        # 4. 分页 (Slice)
-        total = len(raw_candidates)
+        # 3. 排序 + 分页：在列数组上完成
+        candidates = doc_meta.Candidates.merge(parts)
+        total = len(candidates)
         start = (page - 1) * page_size
-        end = start + page_size
-        paged_results = raw_candidates[start:end]
+        page_idx = candidates.order(sort_by)[start:start + page_size]
+        page_rows = list(candidates.rows(page_idx))
+
+        # 4. 只为当前页查库
+        fetched = {}
+        fetched_chunks = {}
+        for lib, key in enumerate(part_keys):
+            fetched[lib] = self.fetch_page(resources[key], [doc_id for l, doc_id, _, _, _ in page_rows if l == lib])
+            fetched_chunks[lib] = self.fetch_chunks(resources[key], [c for l, _, _, _, c in page_rows if l == lib and c >= 0])
+
+        paged_results = []
+        for lib, doc_id, pos, score, chunk_id in page_rows:
+            row = fetched[lib].get(doc_id)
+            if row is None:
+                continue  # 加载后库里已删除
+            fpath, fname, preview = row
+            key = part_keys[lib]
+            meta = candidates.libs[lib]
+            cols = meta.columns
+            mtime = float(cols['mtime'][pos])
+            chapter_idx, chapter_title = fetched_chunks[lib].get(chunk_id, (None, None))
+            paged_results.append({
+                "id": f"{key}_{doc_id}",
+                "source": resources[key]['config']['name'],
+                "filename": fname,
+                "filepath": fpath,
+                "preview": preview,
+                "type": meta.file_types[cols['type_code'][pos]],
+                "mtime": mtime,
+                "mtime_str": datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M'),
+                "score": score,
+                "score_percent": int(score * 100),
+                # 排序用的数值字段
+                "sort_size": round(float(cols['size_mb'][pos]), 2),
+                "sort_res": int(cols['res_pixels'][pos]),
+                "sort_dur": int(cols['duration_sec'][pos]),
+                "external_url": fpath, # 暂时直接返回路径，前端处理跳转
+                # 最相关的章节（从 1 开始，对应阅读页 ?chapter=N），没有章节块命中时为 None
+                "chapter": chapter_idx + 1 if chapter_idx is not None else None,
+                "chapter_title": chapter_title
+            })
 
         return {
             "results": paged_results,
             "total": total,
-            "time": time.time() - t_start
+            "time": time.time() - t_start,
+            # 各库耗时 / 命中数 / 状态（ok、timeout、error），partial 表示有库没有返回结果
+            "libraries": libraries,
+            "partial": any(v["status"] != "ok" for v in libraries.values())
         }
 
 app = Flask(__name__)
@@ -213,13 +327,28 @@ def api_search():
             min_score=float(data.get('min_score', 0.3)),
             sort_by=data.get('sort_by', 'score'),
             page=int(data.get('page', 1)),
-            page_size=int(data.get('page_size', 20))
+            page_size=int(data.get('page_size', 20)),
+            nprobe=data.get('nprobe'),
+            ef_search=data.get('ef_search'),
+            filters={k: data[k] for k in doc_meta.RANGE_FILTERS if k in data}
         )
         return jsonify({"status": "success", **result})
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/reload', methods=['POST'])
+def api_reload():
+    # index.py 跑完后调用，立即换上新索引；force 为真时不比较文件签名，全部重新加载
+    # 允许不带请求体（curl -X POST .../api/reload）
+    data = request.get_json(silent=True) or {}
+    reloaded = engine.load_resources(force=bool(data.get('force')))
+    return jsonify({"status": "success", "reloaded": reloaded})
+
+@app.route('/api/encoder/stats')
+def api_encoder_stats():
+    return jsonify(engine.encoder.stats())
+
 if __name__ == '__main__':
     # threaded=True 支持并发请求
     app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+ANN 索引基准：各索引类型在合成向量上的 recall@k 与查询延迟（以 flat 暴力检索为基准）
+
+用法: python bench_ann.py [--n 100000] [--dim 512] [--queries 500] [--k 20]
+向量按高斯混合生成并归一化，模拟语义向量的聚簇分布；不需要加载模型。
+最后做增量更新自检：删除 + 新增一轮后（与 index.py 的 update_index 相同），
+用库里的向量自查，命中自身的比例不能低于在同一批数据上全量构建的索引。
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+import ann_index
+
+
+def make_vectors(n, dim, clusters, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    x = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(x)
+    return x
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def self_hit(index, vectors, ids, k):
+    """用库里的向量检索，前 k 个结果里包含自身 id 的比例"""
+    _, I = index.search(vectors, k)
+    return float(np.mean([i in row for i, row in zip(ids, I)]))
+
+
+def check_incremental(xb, ids, config, k, sample=2000):
+    """删 10%、加 5% 新 id 之后的自查命中率，返回 (增量, 全量重建)"""
+    n = len(xb)
+    removed, added = n // 10, n // 20
+    keep_x, keep_ids = xb[removed:n - added], ids[removed:n - added]
+    new_x, new_ids = xb[n - added:], ids[n - added:] + n  # 新 id 不与旧 id 重复，模拟 INSERT OR REPLACE
+    index = ann_index.build_index(xb[:n - added], ids[:n - added], config)
+    index.remove_ids(faiss.IDSelectorBatch(ids[:removed]))
+    index.add_with_ids(new_x, new_ids)
+    final_x = np.vstack([keep_x, new_x])
+    final_ids = np.concatenate([keep_ids, new_ids])
+    assert np.array_equal(np.sort(ann_index.index_ids(index)), np.sort(final_ids)), '增量更新后索引中的 id 与预期不符'
+    fresh = ann_index.build_index(final_x, final_ids, config)
+    pick = np.random.default_rng(0).choice(len(final_ids), min(sample, len(final_ids)), replace=False)
+    return self_hit(index, final_x[pick], final_ids[pick], k), self_hit(fresh, final_x[pick], final_ids[pick], k)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n', type=int, default=100000)
+    ap.add_argument('--dim', type=int, default=512)
+    ap.add_argument('--queries', type=int, default=500)
+    ap.add_argument('--k', type=int, default=20)
+    ap.add_argument('--clusters', type=int, default=200)
+    args = ap.parse_args()
+
+    data = make_vectors(args.n + args.queries, args.dim, args.clusters)
+    xb, xq = data[:args.n], data[args.n:]
+    ids = np.arange(args.n, dtype=np.int64)
+
+    # 逐条查询，贴近线上单请求的延迟
+    def run(index, params=None):
+        found = []
+        t0 = time.perf_counter()
+        for q in xq:
+            _, I = index.search(q.reshape(1, -1), args.k, params=params)
+            found.append(I[0])
+        return np.array(found), (time.perf_counter() - t0) / len(xq) * 1000
+
+    cases = [
+        ('flat', {}, [None]),
+        ('ivf_flat', {'nlist': 1024}, [1, 4, 16, 64]),
+        ('hnsw', {'hnsw_m': 32, 'ef_construction': 200}, [16, 64, 256]),
+        ('ivf_pq', {'nlist': 1024, 'pq_m': 64}, [4, 16, 64]),
+    ]
+    truth = None
+    print(f'n={args.n} dim={args.dim} queries={args.queries} k={args.k}')
+    print(f'{"索引":<10}{"参数":<16}{"构建(s)":>10}{"recall@k":>10}{"延迟(ms)":>10}')
+    for index_type, extra, knobs in cases:
+        t0 = time.perf_counter()
+        index = ann_index.build_index(xb, ids, {'index_type': index_type, **extra})
+        build_t = time.perf_counter() - t0
+        for knob in knobs:
+            if index_type == 'hnsw':
+                params = ann_index.search_params(index, ef_search=knob)
+                label = f'efSearch={knob}'
+            elif knob is not None:
+                params = ann_index.search_params(index, nprobe=knob)
+                label = f'nprobe={knob}'
+            else:
+                params, label = None, '-'
+            found, latency = run(index, params)
+            if truth is None:
+                truth = found
+            print(f'{index_type:<10}{label:<16}{build_t:>10.1f}{recall_at_k(found, truth):>10.3f}{latency:>10.3f}')
+
+    # HNSW 不支持删除，update_index 遇到删除会全量重建，不在此列
+    print(f'\n增量更新自检（删 10%、加 5% 后自查 top{args.k} 命中率）')
+    print(f'{"索引":<10}{"增量":>10}{"全量重建":>10}')
+    for index_type, extra in (('flat', {}), ('ivf_flat', {'nlist': 1024}), ('ivf_pq', {'nlist': 1024, 'pq_m': 64}),
+                              ('sq8', {}), ('pq', {'pq_m': 64})):
+        incremental, fresh = check_incremental(xb, ids, {'index_type': index_type, **extra}, args.k)
+        print(f'{index_type:<10}{incremental:>10.3f}{fresh:>10.3f}')
+        assert incremental >= fresh - 0.02, f'{index_type}: 增量更新后检索结果错乱'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+向量压缩基准：数据库存储格式（float32 / float16 / int8）与量化索引（flat / sq_fp16 / sq8 / pq / ivf_pq）
+的内存、构建时间、recall@k，均以 float32 + flat 为基准；
+另测带 id 过滤（范围过滤下推时的 IDSelector）的召回，并检查结果只落在被选中的 id 里
+
+用法: python bench_compress.py [--n 100000] [--dim 512] [--queries 500] [--k 20]
+索引内存按序列化后的大小计（与加载后常驻内存基本一致）。
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+import ann_index
+from bench_ann import make_vectors, recall_at_k
+
+
+def search_all(index, xq, k, selected_ids=None):
+    """selected_ids 不为 None 时只在这些 id 中检索（与 app.py 相同：能下推就用 IDSelector，否则多取后过滤）"""
+    t0 = time.perf_counter()
+    sel, search_k = ann_index.filter_search(index, selected_ids, k)
+    _, I = index.search(xq, search_k, params=ann_index.search_params(index, sel=sel))
+    if selected_ids is not None and sel is None:
+        I = np.array([np.concatenate([row[np.isin(row, selected_ids)], np.full(k, -1)])[:k] for row in I])
+    return I, (time.perf_counter() - t0) / len(xq) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n', type=int, default=100000)
+    ap.add_argument('--dim', type=int, default=512)
+    ap.add_argument('--queries', type=int, default=500)
+    ap.add_argument('--k', type=int, default=20)
+    ap.add_argument('--clusters', type=int, default=200)
+    args = ap.parse_args()
+
+    data = make_vectors(args.n + args.queries, args.dim, args.clusters)
+    xb, xq = data[:args.n], data[args.n:]
+    ids = np.arange(args.n, dtype=np.int64)
+    flat = ann_index.build_index(xb, ids, {})
+    truth, _ = search_all(flat, xq, args.k)
+    # 过滤场景：只在 1/4 的 id 中检索
+    sel_ids = ids[::4]
+    sel_truth, _ = search_all(flat, xq, args.k, sel_ids)
+    print(f'n={args.n} dim={args.dim} queries={args.queries} k={args.k}')
+
+    # 1. 数据库存储格式：BLOB 大小与解码后（flat 索引）的召回
+    print(f'\n{"存储格式":<10}{"BLOB 总量(MB)":>14}{"编解码(s)":>12}{"recall@k":>10}')
+    for dtype in ann_index.EMBEDDING_DTYPES:
+        t0 = time.perf_counter()
+        blobs = [ann_index.encode_embedding(v, dtype) for v in xb]
+        decoded = ann_index.decode_embeddings(blobs, dtype)
+        codec_t = time.perf_counter() - t0
+        found, _ = search_all(ann_index.build_index(decoded, ids, {}), xq, args.k)
+        size_mb = sum(len(b) for b in blobs) / 1024 / 1024
+        print(f'{dtype:<10}{size_mb:>14.1f}{codec_t:>12.2f}{recall_at_k(found, truth):>10.3f}')
+
+    # 2. 索引类型：常驻内存、构建时间、召回与延迟
+    print(f'\n{"索引":<10}{"内存(MB)":>10}{"构建(s)":>10}{"recall@k":>10}{"延迟(ms)":>10}{"过滤recall":>12}')
+    cases = [
+        ('flat', {}),
+        ('sq_fp16', {}),
+        ('sq8', {}),
+        ('pq', {'pq_m': 64}),
+        ('ivf_pq', {'pq_m': 64, 'nprobe': 32}),
+    ]
+    for index_type, extra in cases:
+        t0 = time.perf_counter()
+        index = ann_index.build_index(xb, ids, {'index_type': index_type, **extra})
+        build_t = time.perf_counter() - t0
+        mem_mb = faiss.serialize_index(index).nbytes / 1024 / 1024
+        found, latency = search_all(index, xq, args.k)
+        sel_found, _ = search_all(index, xq, args.k, sel_ids)
+        hit = sel_found[sel_found >= 0]
+        assert np.isin(hit, sel_ids).all(), f'{index_type}: 过滤检索返回了未选中的 id'
+        print(f'{index_type:<10}{mem_mb:>10.1f}{build_t:>10.1f}{recall_at_k(found, truth):>10.3f}{latency:>10.3f}'
+              f'{recall_at_k(sel_found, sel_truth):>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+查询编码压测：每个请求单独 encode（旧） vs. LRU 缓存 + 微批编码（新），输出 p50/p99 延迟与吞吐
+
+用法: python bench_query.py [--clients 16] [--requests 2000] [--vocab 300] [--model ./bge_model]
+不指定 --model 时使用模拟模型：每次 encode 独占计算资源，耗时 = 固定开销 + 每条查询开销，
+与 CPU/GPU 上前向计算的特性一致（并发请求互相排队，批量越大摊得越薄）。
+查询按 Zipf 分布从词表中抽取，模拟热门查询与翻页带来的重复。
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import query_encoder
+
+
+class SimulatedModel:
+    def __init__(self, dim=512, base_ms=15.0, per_query_ms=1.0):
+        self.dim = dim
+        self.base = base_ms / 1000
+        self.per_query = per_query_ms / 1000
+        self._lock = threading.Lock()
+
+    def encode(self, texts, normalize_embeddings=True):
+        with self._lock:
+            time.sleep(self.base + self.per_query * len(texts))
+        vecs = np.stack([
+            np.random.default_rng(abs(hash(t)) % 2 ** 32).standard_normal(self.dim) for t in texts
+        ]).astype(np.float32)
+        return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+class DirectEncoder:
+    # 旧实现：每个请求各自调用 model.encode([query])
+    def __init__(self, model):
+        self.model = model
+
+    def encode(self, query):
+        return self.model.encode([query], normalize_embeddings=True)
+
+
+def run(encoder, queries, clients):
+    latencies = np.empty(len(queries))
+
+    def one(i):
+        t0 = time.perf_counter()
+        encoder.encode(queries[i])
+        latencies[i] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as ex:
+        list(ex.map(one, range(len(queries))))
+    wall = time.perf_counter() - t0
+    return latencies * 1000, len(queries) / wall
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--clients', type=int, default=16)
+    ap.add_argument('--requests', type=int, default=2000)
+    ap.add_argument('--vocab', type=int, default=300, help='不同查询的个数')
+    ap.add_argument('--model', help='SentenceTransformer 模型路径，不填则使用模拟模型')
+    args = ap.parse_args()
+
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.model)
+    else:
+        model = SimulatedModel()
+
+    rng = np.random.default_rng(0)
+    ranks = np.minimum(rng.zipf(1.3, args.requests), args.vocab)
+    queries = [f'查询 {r}' for r in ranks]
+    print(f'请求 {args.requests} 个，不同查询 {len(set(queries))} 个，并发 {args.clients}')
+    print(f'{"模式":<10}{"p50(ms)":>10}{"p99(ms)":>10}{"吞吐(req/s)":>14}')
+
+    for name, encoder in (('逐条编码', DirectEncoder(model)), ('缓存+微批', query_encoder.QueryEncoder(model))):
+        lat, qps = run(encoder, queries, args.clients)
+        print(f'{name:<10}{np.percentile(lat, 50):>10.1f}{np.percentile(lat, 99):>10.1f}{qps:>14.1f}')
+        if isinstance(encoder, query_encoder.QueryEncoder):
+            print('  ', encoder.stats())
+
+    # 无重复查询时只有微批生效
+    unique = [f'唯一查询 {i}' for i in range(args.requests // 4)]
+    for name, encoder in (('逐条编码', DirectEncoder(model)), ('仅微批', query_encoder.QueryEncoder(model))):
+        lat, qps = run(encoder, unique, args.clients)
+        print(f'{name + "*":<10}{np.percentile(lat, 50):>10.1f}{np.percentile(lat, 99):>10.1f}{qps:>14.1f}')
+    print('* 全部为不同查询')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+语义搜索的列式元数据（app.py 使用）
+
+启动 / 重载时把每个库用于过滤、排序的数值列一次性读成 NumPy 数组（按 id 排序），
+查询时候选的过滤、排序、分页全部向量化完成，只有最终一页才回 SQLite 取路径和预览。
+范围过滤（时长、大小、分辨率）在向量检索前就转成 id 选择器，候选池里只有符合条件的文档。
+开启章节模式的库另有章节块索引，命中的块映射回所属文档后按文档聚合（max / sum）。
+"""
+import re
+import sqlite3
+
+import numpy as np
+
+# sort_by -> (列名, 是否降序)；score 之外的排序同值时仍按分数从高到低
+SORT_KEYS = {
+    'date_desc': ('mtime', True),
+    'date_asc': ('mtime', False),
+    'size': ('size_mb', True),
+    'duration': ('duration_sec', True),   # 长视频在前
+    'resolution': ('res_pixels', True),   # 高清在前
+    'name': ('filename', False),          # A-Z
+}
+
+
+# 视频的数值元数据列（index.py 写入，旧库由 ensure_schema 从预览文本解析一次补齐）
+VIDEO_COLUMNS = (
+    ('width', 'INTEGER'),
+    ('height', 'INTEGER'),
+    ('fps', 'REAL'),
+    ('duration_sec', 'REAL'),
+    ('size_bytes', 'INTEGER'),
+)
+
+# 范围过滤：API 参数 -> (列名, 比较方向)
+RANGE_FILTERS = {
+    'min_duration': ('duration_sec', '>='),  # 秒
+    'max_duration': ('duration_sec', '<='),
+    'min_size_mb': ('size_mb', '>='),
+    'max_size_mb': ('size_mb', '<='),
+    'min_height': ('height', '>='),          # 例如 720 表示 720p 及以上
+}
+
+
+def parse_video_preview(preview_text):
+    """
+    从旧版描述文本中提取数值（仅用于迁移旧库）
+    文本示例: "Size: 50.20MB, Resolution: 1920x1080, Duration: 5m30s"
+    """
+    meta = {"width": None, "height": None, "fps": None, "duration_sec": None, "size_bytes": 0}
+    if not preview_text:
+        return meta
+
+    size_match = re.search(r'Size:\s*([\d\.]+)MB', preview_text)
+    if size_match:
+        meta['size_bytes'] = int(float(size_match.group(1)) * 1024 * 1024)
+
+    res_match = re.search(r'Resolution:\s*(\d+)x(\d+)', preview_text)
+    if res_match:
+        meta['width'], meta['height'] = int(res_match.group(1)), int(res_match.group(2))
+
+    dur_match = re.search(r'Duration:\s*(\d+)m(\d+)s', preview_text)
+    if dur_match:
+        mins, secs = int(dur_match.group(1)), int(dur_match.group(2))
+        meta['duration_sec'] = mins * 60 + secs
+
+    return meta
+
+
+def ensure_schema(conn):
+    """补齐数值元数据列；旧库的视频行从预览文本解析一次写回"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+    for name, col_type in VIDEO_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE documents ADD COLUMN {name} {col_type}")
+    # 过滤和排序都在内存列数组上完成，按列建的 SQL 索引用不到，只会拖慢写入；早期版本建过的删掉
+    for name in ('idx_mtime', 'idx_duration', 'idx_size', 'idx_resolution'):
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+    rows = conn.execute(
+        "SELECT id, preview_content FROM documents WHERE file_type = 'video' AND size_bytes IS NULL"
+    ).fetchall()
+    if rows:
+        print(f"迁移 {len(rows)} 条视频元数据...")
+        updates = []
+        for doc_id, preview in rows:
+            m = parse_video_preview(preview)
+            updates.append((m['width'], m['height'], m['fps'], m['duration_sec'], m['size_bytes'], doc_id))
+        conn.executemany(
+            "UPDATE documents SET width = ?, height = ?, fps = ?, duration_sec = ?, size_bytes = ? WHERE id = ?",
+            updates
+        )
+    conn.commit()
+
+
+def _lookup(sorted_ids, ids):
+    """ids -> sorted_ids 中的行号；返回 (行号, 是否存在的掩码)"""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(sorted_ids):
+        return np.empty(0, dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    found = sorted_ids[pos] == ids
+    return pos[found], found
+
+
+def _float_column(values):
+    # None（文本文件或未读到元数据）记为 0
+    return np.nan_to_num(np.array(values, dtype=np.float64))
+
+
+class LibraryMeta:
+    """单个库的列式元数据，各列按 ids 升序对齐"""
+
+    def __init__(self, ids, columns, file_types):
+        self.ids = ids
+        self.columns = columns
+        self.file_types = file_types  # type_code -> file_type 字符串
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, db_path):
+        with sqlite3.connect(db_path) as conn:
+            ensure_schema(conn)
+            rows = conn.execute(
+                "SELECT id, filename, file_type, mtime, width, height, fps, duration_sec, size_bytes "
+                "FROM documents ORDER BY id"
+            ).fetchall()
+
+        ids, filename, file_type, mtime, width, height, fps, duration, size_bytes = (
+            zip(*rows) if rows else ([],) * 9
+        )
+        file_types, type_code = np.unique(
+            np.array([t or '' for t in file_type], dtype=object), return_inverse=True
+        )
+        width = _float_column(width).astype(np.int64)
+        height = _float_column(height).astype(np.int64)
+        columns = {
+            'mtime': _float_column(mtime),
+            'size_mb': _float_column(size_bytes) / (1024 * 1024),
+            'width': width,
+            'height': height,
+            'res_pixels': width * height,
+            'fps': _float_column(fps),
+            'duration_sec': _float_column(duration),
+            'type_code': type_code.astype(np.int8),
+            'filename': np.array([f or '' for f in filename], dtype=object),
+        }
+        return cls(np.array(ids, dtype=np.int64), columns, list(file_types))
+
+    def filter_mask(self, filters):
+        """按范围过滤生成整库的行掩码；没有有效过滤条件时返回 None"""
+        mask = None
+        for param, value in (filters or {}).items():
+            if param not in RANGE_FILTERS or value in (None, ''):
+                continue
+            name, op = RANGE_FILTERS[param]
+            col = self.columns[name]
+            cond = col >= float(value) if op == '>=' else col <= float(value)
+            mask = cond if mask is None else mask & cond
+        return mask
+
+    def lookup(self, doc_ids):
+        """doc_ids -> 行号；返回 (行号, 是否存在的掩码)，不存在的 id（库已变更）被丢弃"""
+        return _lookup(self.ids, doc_ids)
+
+
+class ChunkMeta:
+    """章节块 id -> (所属文档 id, 章节序号)，按 id 升序对齐"""
+
+    def __init__(self, ids, doc, chapter):
+        self.ids = ids
+        self.doc = doc
+        self.chapter = chapter
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, db_path):
+        """库里没有章节块表时返回 None"""
+        with sqlite3.connect(db_path) as conn:
+            try:
+                rows = conn.execute("SELECT id, doc_id, chapter_idx FROM chunks ORDER BY id").fetchall()
+            except sqlite3.OperationalError:
+                return None
+        arr = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        return cls(arr[:, 0], arr[:, 1], arr[:, 2])
+
+    def lookup(self, chunk_ids):
+        return _lookup(self.ids, chunk_ids)
+
+    def select(self, doc_ids):
+        """属于 doc_ids 的章节块 id（范围过滤下推到章节块索引时使用）"""
+        return self.ids[np.isin(self.doc, doc_ids)]
+
+
+def aggregate_hits(doc_ids, scores, chunk_ids, agg='max'):
+    """
+    把文件级与章节块级的命中按文档聚合
+    chunk_ids 为 -1 表示文件级命中。返回 (文档 id, 排序分, 最高分, 最佳章节块 id 或 -1)，
+    排序分在 agg='max' 时即最高分，agg='sum' 时为各命中分数之和（多个章节都相关的书靠前）
+    """
+    if not len(doc_ids):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32), empty
+    # 按文档分组、组内分数降序
+    order = np.lexsort((-scores, doc_ids))
+    doc_ids, scores, chunk_ids = doc_ids[order], scores[order], chunk_ids[order]
+    starts = np.flatnonzero(np.r_[True, doc_ids[1:] != doc_ids[:-1]])
+    best = scores[starts]
+    rank = np.add.reduceat(scores, starts) if agg == 'sum' else best
+    # 组内第一条章节块命中即分数最高的章节
+    n = len(chunk_ids)
+    first_chunk = np.minimum.reduceat(np.where(chunk_ids >= 0, np.arange(n), n), starts)
+    ends = np.r_[starts[1:], n]
+    best_chunk = np.where(first_chunk < ends, chunk_ids[np.minimum(first_chunk, n - 1)], -1)
+    return doc_ids[starts], rank, best, best_chunk
+
+
+class Candidates:
+    """
+    跨库合并后的候选列：lib 为所属库在 libs 中的下标，pos 为库内行号，
+    score 为排序分，best 为展示用的最高分，chunk 为最佳章节块 id（-1 表示没有）
+    """
+
+    def __init__(self, libs, lib, pos, score, best, chunk):
+        self.libs = libs
+        self.lib = lib
+        self.pos = pos
+        self.score = score
+        self.best = best
+        self.chunk = chunk
+
+    def __len__(self):
+        return len(self.score)
+
+    @classmethod
+    def merge(cls, parts):
+        """parts: [(LibraryMeta, 行号, 排序分, 最高分, 最佳章节块 id), ...]"""
+        libs = [part[0] for part in parts]
+        if not parts:
+            empty = np.empty(0, dtype=np.int64)
+            no_score = np.empty(0, dtype=np.float32)
+            return cls(libs, empty, empty, no_score, no_score, empty)
+        lib = np.concatenate([np.full(len(part[1]), i, dtype=np.int64) for i, part in enumerate(parts)])
+        columns = [np.concatenate([part[k] for part in parts]) for k in range(1, 5)]
+        return cls(libs, lib, *columns)
+
+    def column(self, name):
+        # merge 按库依次拼接，lib 连续分段，逐库取列后直接拼接即与候选顺序一致
+        if not len(self):
+            return np.empty(0)
+        return np.concatenate([
+            meta.columns[name][self.pos[self.lib == i]] for i, meta in enumerate(self.libs)
+        ])
+
+    def order(self, sort_by):
+        """返回排序后的候选下标"""
+        by_score = np.argsort(-self.score, kind='stable')
+        if sort_by not in SORT_KEYS:
+            return by_score
+        name, descending = SORT_KEYS[sort_by]
+        key = self.column(name)[by_score]
+        if descending:
+            key = -key
+        return by_score[np.argsort(key, kind='stable')]
+
+    def rows(self, idx):
+        """取出指定候选的 (LibraryMeta 下标, 文档 id, 行号, 最高分, 最佳章节块 id)"""
+        for i in idx:
+            lib = int(self.lib[i])
+            pos = int(self.pos[i])
+            yield lib, int(self.libs[lib].ids[pos]), pos, float(self.best[i]), int(self.chunk[i])
@@ -1,4 +1,8 @@
+import argparse
 import os
+import sys
+import queue
+import threading
 import time
 import sqlite3
 import numpy as np
@@ -7,6 +11,15 @@ from tqdm import tqdm
 import faiss
 import pickle
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import ann_index
+import doc_meta
+
+# 章节切分复用主程序的 utils.extract_chapters，保证章节序号与阅读页 /reader/<id>?chapter=N 一致
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
 
 # 设置代理（如不需要可注释）
 os.environ['http_proxy'] = 'http://127.0.0.1:57713'
@@ -22,6 +35,9 @@ except ImportError:
 
 # --- 全局配置列表 ---
 # 在这里定义多个索引任务，彼此独立
+# index_type 可选 flat / ivf_flat / hnsw / ivf_pq，其余参数见 ann_index.py
+# 文本库可设 "chunk_mode": "chapter"，按章节额外生成向量（单独的 *_chunks.faiss），语义搜索可命中正文深处：
+#   chunk_chars 每章取多少字编码，max_chunks_per_doc 单本上限（超出时均匀抽样章节），max_chunks 整库上限
 CONFIG_LIST = [
     {
         "name": "Local_Novels",
@@ -29,7 +45,8 @@ CONFIG_LIST = [
         "db_path": "db_novels.sqlite",
         "index_path": "index_novels.faiss",
         "type": "text",  # 类型：text 或 video
-        "extensions": ('.txt', '.md', '.epub')
+        "extensions": ('.txt', '.md', '.epub'),
+        "index_type": "flat"
     },
     {
         "name": "Nas_Novels",
@@ -37,7 +54,9 @@ CONFIG_LIST = [
         "db_path": "db_nas_novels.sqlite",
         "index_path": "index_nas_novels.faiss",
         "type": "text",
-        "extensions": ('.txt', '.md')
+        "extensions": ('.txt', '.md'),
+        "index_type": "flat"  # 库很大时可改为 "ivf_flat"（配合 "nprobe": 16）或 "hnsw"；内存紧张时用 "sq8"
+        # "embedding_dtype": "float16"  # 数据库向量按半精度存储，体积减半，召回基本不变
     },
     {
         "name": "My_Videos",
@@ -45,12 +64,18 @@ CONFIG_LIST = [
         "db_path": "db_videos.sqlite",
         "index_path": "index_videos.faiss",
         "type": "video",
-        "extensions": ('.mp4', '.mkv', '.avi', '.mov')
+        "extensions": ('.mp4', '.mkv', '.avi', '.mov'),
+        "index_type": "flat"
     }
 ]
 
 MODEL_NAME = "BAAI/bge-small-zh-v1.5"
 BATCH_SIZE = 64
+CHUNK_CHARS = 500            # 章节块：每章开头取多少字参与编码
+MAX_CHUNKS_PER_DOC = 200     # 章节块：单本小说最多生成的块数
+MAX_CHUNKS = 500000          # 章节块：整个库最多保存的块数（约 1GB 向量）
+READ_WORKERS = 8  # 每批次并发读取文件的线程数（NAS 读取延迟高），可在配置中用 read_workers 覆盖
+QUEUE_DEPTH = 4   # 流水线各阶段之间最多缓冲的批次数，可在配置中用 queue_depth 覆盖
 READ_CHARS = 1000  # 文本读取字数上限
 
 class FileIndexer:
@@ -59,9 +84,10 @@ class FileIndexer:
         self.model = SentenceTransformer(model_name)
 
     def get_video_metadata(self, filepath):
-        """提取视频元信息：时长、分辨率、大小"""
-        file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
-        meta_str = f"Size: {file_size_mb:.2f}MB"
+        """提取视频元信息：时长、分辨率、大小；返回 (展示文本, 数值字段)"""
+        size_bytes = os.path.getsize(filepath)
+        meta = {"width": None, "height": None, "fps": None, "duration_sec": None, "size_bytes": size_bytes}
+        meta_str = f"Size: {size_bytes / (1024 * 1024):.2f}MB"
         
         if CV2_AVAILABLE:
             try:
@@ -77,17 +103,19 @@ class FileIndexer:
                     seconds = int(duration % 60)
                     
                     meta_str += f", Resolution: {int(width)}x{int(height)}, Duration: {minutes}m{seconds}s"
+                    meta.update(width=int(width), height=int(height), fps=fps, duration_sec=duration)
                 cap.release()
             except Exception as e:
                 pass # 读取视频流失败则只保留文件大小
-        return meta_str
+        return meta_str, meta
 
     def read_file_content(self, filepath, file_type):
         """
         核心读取函数
-        返回: (preview_text, embedding_text)
+        返回: (preview_text, embedding_text, meta)
         preview_text: 用于存数据库展示
         embedding_text: 用于生成向量（包含文件名和关键信息）
+        meta: 视频的数值元数据（width/height/fps/duration_sec/size_bytes），文本为空
         """
         filename = os.path.basename(filepath)
         
@@ -108,20 +136,24 @@ class FileIndexer:
             except Exception:
                 content = "Read Error"
             
-            # 清洗空白字符
-            content = content.strip()
-            # 向量化文本 = 文件名 + 换行 + 文本内容 (增加文件名的权重)
-            embedding_text = f"文件名: {filename}\n内容: {content}"
-            return content, embedding_text
+            return self.text_preview(filename, content)
 
         # --- 策略 B: 视频/非文本文件 ---
         elif file_type == 'video':
-            meta = self.get_video_metadata(filepath)
+            meta_str, meta = self.get_video_metadata(filepath)
             # 向量化文本 = 文件名 + 元数据
-            embedding_text = f"文件名: {filename}\n信息: {meta}"
-            return meta, embedding_text
+            embedding_text = f"文件名: {filename}\n信息: {meta_str}"
+            return meta_str, embedding_text, meta
         
-        return "", filename
+        return "", filename, {}
+
+    def text_preview(self, filename, content):
+        """文本文件的 (preview_text, embedding_text, meta)"""
+        # 清洗空白字符
+        content = content.strip()
+        # 向量化文本 = 文件名 + 换行 + 文本内容 (增加文件名的权重)
+        embedding_text = f"文件名: {filename}\n内容: {content}"
+        return content, embedding_text, {}
 
     def init_db(self, db_path):
         """初始化单个配置的数据库"""
@@ -138,10 +170,27 @@ class FileIndexer:
                 )
             """)
             conn.execute("CREATE INDEX IF NOT EXISTS idx_filepath ON documents(filepath)")
-            conn.commit()
+            # 章节块（chunk_mode=chapter 时写入）；documents.chunk_count 为 NULL 表示尚未切块
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    doc_id INTEGER NOT NULL,
+                    chapter_idx INTEGER,
+                    char_offset INTEGER,
+                    title TEXT,
+                    embedding BLOB
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(doc_id)")
+            if 'chunk_count' not in {row[1] for row in conn.execute("PRAGMA table_info(documents)")}:
+                conn.execute("ALTER TABLE documents ADD COLUMN chunk_count INTEGER")
+            # 记录上次全量构建后的累计增量变更，用于决定何时压缩重建
+            conn.execute("CREATE TABLE IF NOT EXISTS index_state (key TEXT PRIMARY KEY, value TEXT)")
+            # 视频数值列 + 排序/过滤索引，旧库在这里迁移
+            doc_meta.ensure_schema(conn)
 
-    def run_config(self, config):
-        """运行单个配置任务"""
+    def run_config(self, config, rebuild=False):
+        """运行单个配置任务；rebuild=True 时全量重建索引"""
         print(f"\n--- 处理任务: {config['name']} ---")
         
         folder = config['folder']
@@ -149,12 +198,14 @@ class FileIndexer:
         index_path = config['index_path']
         file_type = config['type']
         extensions = config['extensions']
+        chunked = file_type == 'text' and config.get('chunk_mode') == 'chapter'
 
         if not os.path.exists(folder):
             print(f"跳过: 文件夹不存在 {folder}")
             return
 
         self.init_db(db_path)
+        self.ensure_embedding_dtype(db_path, config.get('embedding_dtype', 'float32'))
 
         # 1. 扫描本地文件
         local_files = {}
@@ -167,15 +218,18 @@ class FileIndexer:
 
         # 2. 读取数据库状态
         with sqlite3.connect(db_path) as conn:
-            cursor = conn.execute("SELECT filepath, mtime FROM documents")
-            db_files = {row[0]: row[1] for row in cursor.fetchall()}
+            cursor = conn.execute("SELECT filepath, mtime, chunk_count FROM documents")
+            rows = cursor.fetchall()
+            db_files = {row[0]: row[1] for row in rows}
+            # 新开启章节模式时，已索引但未切块的文件也要重新处理
+            unchunked = {row[0] for row in rows if row[2] is None} if chunked else set()
 
         # 3. 计算差异
         to_delete = set(db_files.keys()) - set(local_files.keys())
         to_process = []
         
         for fpath, mtime in local_files.items():
-            if fpath not in db_files or db_files[fpath] != mtime:
+            if fpath not in db_files or db_files[fpath] != mtime or fpath in unchunked:
                 to_process.append(fpath)
 
         # 4. 执行删除
@@ -189,89 +243,403 @@ class FileIndexer:
                     conn.execute(f"DELETE FROM documents WHERE filepath IN ({placeholders})", chunk)
                 conn.commit()
 
-        # 5. 执行新增/更新
+        # 已删除文件的章节块一并清掉（没有外键级联）；重新处理的文件由写入线程在替换文档行时删除旧块
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("DELETE FROM chunks WHERE doc_id NOT IN (SELECT id FROM documents)")
+            conn.commit()
+
+        # 5. 执行新增/更新（读取 / 编码 / 写入流水线）
         if to_process:
             print(f"发现 {len(to_process)} 个文件需要更新...")
-            with sqlite3.connect(db_path) as conn:
-                for i in tqdm(range(0, len(to_process), BATCH_SIZE), desc="索引中"):
-                    batch_paths = to_process[i : i + BATCH_SIZE]
-                    
-                    texts_to_embed = []
-                    rows_to_insert = []
-                    
-                    # 批量读取内容
-                    for fpath in batch_paths:
-                        preview, embed_text = self.read_file_content(fpath, file_type)
-                        texts_to_embed.append(embed_text)
-                        
-                        mtime = local_files[fpath]
-                        filename = os.path.basename(fpath)
-                        rows_to_insert.append({
-                            "path": fpath, "name": filename, 
-                            "type": file_type, "mtime": mtime, 
-                            "preview": preview
-                        })
-
-                    # 批量生成向量
-                    if texts_to_embed:
-                        embeddings = self.model.encode(texts_to_embed, normalize_embeddings=True)
-                        
-                        # 组合数据
-                        final_data = []
-                        for idx, row in enumerate(rows_to_insert):
-                            emb_blob = embeddings[idx].astype(np.float32).tobytes()
-                            final_data.append((
-                                row["path"], row["name"], row["type"], 
-                                row["mtime"], row["preview"], emb_blob
-                            ))
-                        
-                        conn.executemany("""
-                            INSERT OR REPLACE INTO documents 
-                            (filepath, filename, file_type, mtime, preview_content, embedding)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        """, final_data)
-                        conn.commit()
+            self.process_files(db_path, to_process, local_files, file_type, config, chunked)
         else:
             print("文件无变化。")
 
-        # 6. 生成独立索引文件
-        self.export_index(db_path, index_path)
+        # 6. 更新独立索引文件（默认增量，必要时全量重建）；章节块单独一个索引文件
+        targets = [('documents', index_path)]
+        if chunked:
+            targets.append(('chunks', ann_index.chunk_index_path(config)))
+        for table, path in targets:
+            if rebuild:
+                self.export_index(db_path, path, config, table)
+            else:
+                self.update_index(db_path, path, config, table)
+
+    def chapter_chunks(self, text, config):
+        """
+        按章节生成向量块，章节切分与主程序一致（text 须由 utils.read_text_and_encoding 解码）
+        返回: [(chapter_idx, char_offset, title, text), ...]，chapter_idx 从 0 开始
+        """
+        chapters = utils.extract_chapters(text)
+        chunk_chars = config.get('chunk_chars', CHUNK_CHARS)
+        cap = config.get('max_chunks_per_doc', MAX_CHUNKS_PER_DOC)
+        picks = range(len(chapters))
+        if len(chapters) > cap:
+            # 章节过多时均匀抽样，保证全书各处都有覆盖
+            picks = np.unique(np.linspace(0, len(chapters) - 1, cap).astype(int))
+        chunks = []
+        for idx in picks:
+            ch = chapters[idx]
+            body = text[ch['start']:ch['start'] + chunk_chars].strip()
+            if body:
+                chunks.append((int(idx), ch['start'], ch['title'], body))
+        return chunks
+
+    def _read_row(self, fpath, file_type, mtime, config, chunked):
+        """读取单个文件，返回待编码的行；读取失败（如文件已被删除）返回 None"""
+        try:
+            if chunked:
+                # 章节模式要读全文：只读一次、只判断一次编码，预览和章节块都取自同一份文本
+                text, _ = utils.read_text_and_encoding(Path(fpath))
+                # 与 read_file_content 的文本模式读取一致：换行统一成 \n，取前 READ_CHARS 个字
+                head = text[:READ_CHARS + 1].replace('\r\n', '\n').replace('\r', '\n')[:READ_CHARS]
+                preview, embed_text, meta = self.text_preview(os.path.basename(fpath), head)
+                chunks = self.chapter_chunks(text, config)
+            else:
+                preview, embed_text, meta = self.read_file_content(fpath, file_type)
+                chunks = None
+        except Exception as e:
+            print(f"读取失败 {fpath}: {e}")
+            return None
+        return {
+            "path": fpath, "name": os.path.basename(fpath),
+            "type": file_type, "mtime": mtime,
+            "preview": preview, "meta": meta, "text": embed_text,
+            "chunks": chunks
+        }
+
+    def process_files(self, db_path, paths, local_files, file_type, config, chunked=False):
+        """
+        三段流水线，互相重叠：
+        读取线程（内部 read_workers 个线程并发读 NAS）预取后续批次 -> 主线程编码当前批次 -> 写入线程提交上一批次
+        阶段之间是深度为 queue_depth 的有界队列；结束时输出各阶段吞吐（文件/s），最慢的阶段即瓶颈
+        chunked=True 时每个文件额外生成章节块，与文件向量在同一次 encode 中编码
+        """
+        read_workers = config.get('read_workers', READ_WORKERS)
+        dtype = config.get('embedding_dtype', 'float32')
+        depth = config.get('queue_depth', QUEUE_DEPTH)
+        batches = [paths[i:i + BATCH_SIZE] for i in range(0, len(paths), BATCH_SIZE)]
+        read_q = queue.Queue(depth)
+        write_q = queue.Queue(depth)
+        stats = {"读取": [0, 0.0], "编码": [0, 0.0], "写入": [0, 0.0]}  # 阶段 -> [文件数, 累计耗时]
+        errors = []
+        stop = threading.Event()
+
+        # 整库章节块配额：读取阶段就裁掉超额的块，不浪费编码（本次要替换的文件的旧块不计入）
+        chunk_budget = 0
+        if chunked:
+            with sqlite3.connect(db_path) as conn:
+                existing = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+                for i in range(0, len(paths), 900):
+                    chunk = paths[i:i+900]
+                    placeholders = ','.join(['?'] * len(chunk))
+                    existing -= conn.execute(
+                        f"SELECT COUNT(*) FROM chunks WHERE doc_id IN "
+                        f"(SELECT id FROM documents WHERE filepath IN ({placeholders}))", chunk
+                    ).fetchone()[0]
+            chunk_budget = max(config.get('max_chunks', MAX_CHUNKS) - existing, 0)
+
+        def reader():
+            nonlocal chunk_budget
+            try:
+                with ThreadPoolExecutor(max_workers=read_workers) as pool:
+                    for batch in batches:
+                        if stop.is_set():
+                            break
+                        t0 = time.time()
+                        rows = [r for r in pool.map(
+                            lambda p: self._read_row(p, file_type, local_files[p], config, chunked), batch
+                        ) if r]
+                        for r in rows:
+                            if r["chunks"] is not None:
+                                if len(r["chunks"]) > chunk_budget:
+                                    if chunk_budget:
+                                        print(f"提示: 章节块已达整库上限 {config.get('max_chunks', MAX_CHUNKS)}，后续文件只保留文件级向量")
+                                    r["chunks"] = r["chunks"][:chunk_budget]
+                                chunk_budget -= len(r["chunks"])
+                        stats["读取"][0] += len(rows)
+                        stats["读取"][1] += time.time() - t0
+                        read_q.put(rows)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                read_q.put(None)
+
+        def writer():
+            conn = sqlite3.connect(db_path)
+            try:
+                while True:
+                    data = write_q.get()
+                    if data is None:
+                        break
+                    if errors:
+                        continue  # 已出错，只排空队列
+                    t0 = time.time()
+                    try:
+                        for doc, chunk_rows in data:
+                            # 旧章节块与文档行在同一事务里替换：读取失败的文件保留原来的行和块，下次照常重试
+                            conn.execute(
+                                "DELETE FROM chunks WHERE doc_id IN (SELECT id FROM documents WHERE filepath = ?)",
+                                (doc[0],)
+                            )
+                            cursor = conn.execute("""
+                                INSERT OR REPLACE INTO documents 
+                                (filepath, filename, file_type, mtime, preview_content, embedding,
+                                 width, height, fps, duration_sec, size_bytes, chunk_count)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            """, doc)
+                            if chunk_rows:
+                                doc_id = cursor.lastrowid
+                                conn.executemany("""
+                                    INSERT INTO chunks (doc_id, chapter_idx, char_offset, title, embedding)
+                                    VALUES (?, ?, ?, ?, ?)
+                                """, [(doc_id,) + c for c in chunk_rows])
+                        conn.commit()
+                    except Exception as e:
+                        errors.append(e)
+                        stop.set()
+                    stats["写入"][0] += len(data)
+                    stats["写入"][1] += time.time() - t0
+            finally:
+                conn.close()
+
+        t_start = time.time()
+        read_thread = threading.Thread(target=reader, name="index-reader", daemon=True)
+        write_thread = threading.Thread(target=writer, name="index-writer", daemon=True)
+        read_thread.start()
+        write_thread.start()
+        try:
+            with tqdm(total=len(paths), desc="索引中", unit="file") as bar:
+                while True:
+                    rows = read_q.get()
+                    if rows is None:
+                        break
+                    if errors or not rows:
+                        continue
+                    t0 = time.time()
+                    # 文件向量与章节块一起编码，章节块的向量排在文件向量之后
+                    texts = [r["text"] for r in rows]
+                    for r in rows:
+                        texts.extend(c[3] for c in r["chunks"] or ())
+                    embeddings = self.model.encode(texts, normalize_embeddings=True)
+                    stats["编码"][0] += len(rows)
+                    stats["编码"][1] += time.time() - t0
+
+                    final_data = []
+                    offset = len(rows)
+                    for idx, row in enumerate(rows):
+                        meta = row["meta"]
+                        chunk_rows = []
+                        for chapter_idx, char_offset, title, _ in row["chunks"] or ():
+                            chunk_rows.append((chapter_idx, char_offset, title,
+                                               ann_index.encode_embedding(embeddings[offset], dtype)))
+                            offset += 1
+                        final_data.append(((
+                            row["path"], row["name"], row["type"],
+                            row["mtime"], row["preview"], ann_index.encode_embedding(embeddings[idx], dtype),
+                            meta.get("width"), meta.get("height"), meta.get("fps"),
+                            meta.get("duration_sec"), meta.get("size_bytes"),
+                            len(chunk_rows) if row["chunks"] is not None else None
+                        ), chunk_rows))
+                    write_q.put(final_data)
+                    bar.update(len(rows))
+        finally:
+            # 无论正常结束还是出错，都让读取线程退出、写入线程写完已编码的批次
+            stop.set()
+            while read_thread.is_alive():
+                try:
+                    read_q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            write_q.put(None)
+            write_thread.join()
+
+        if errors:
+            raise errors[0]
+
+        wall = time.time() - t_start
+        print(f"流水线完成: {len(paths)} 个文件，用时 {wall:.1f}s（{len(paths) / wall:.1f} 文件/s）")
+        for stage, (count, secs) in stats.items():
+            rate = count / secs if secs else 0
+            print(f"  {stage}: {count} 个文件，累计 {secs:.1f}s，{rate:.1f} 文件/s")
 
-    def export_index(self, db_path, index_path):
-        """生成 FAISS 索引"""
+    def export_index(self, db_path, index_path, config=None, table='documents'):
+        """生成 FAISS 索引（table 为 documents 或 chunks）"""
         print(f"正在生成索引: {index_path}")
         with sqlite3.connect(db_path) as conn:
-            cursor = conn.execute("SELECT id, embedding FROM documents")
+            dtype = get_state(conn, 'embedding_dtype', 'float32')
+            cursor = conn.execute(f"SELECT id, embedding FROM {table}")
             ids = []
-            vectors = []
+            blobs = []
             for row in cursor:
                 ids.append(row[0])
-                vectors.append(np.frombuffer(row[1], dtype=np.float32))
+                blobs.append(row[1])
         
-        if not vectors:
+        if not blobs:
             print("警告: 数据库为空，跳过生成索引。")
             return
 
-        vectors_np = np.array(vectors)
+        vectors_np = ann_index.decode_embeddings(blobs, dtype)
+        del blobs
         ids_np = np.array(ids).astype('int64')
         
-        # 建立索引 (Inner Product 用于余弦相似度)
-        dimension = vectors_np.shape[1]
-        index = faiss.IndexFlatIP(dimension)
-        index_with_ids = faiss.IndexIDMap(index)
-        index_with_ids.add_with_ids(vectors_np, ids_np)
+        # 建立索引 (Inner Product 用于余弦相似度)，类型由配置决定，IVF/PQ 会先在样本上训练
+        t0 = time.time()
+        index_with_ids = ann_index.build_index(vectors_np, ids_np, config or {})
         
-        faiss.write_index(index_with_ids, index_path)
-        print(f"索引生成完毕，包含 {len(ids)} 条数据。")
+        ann_index.write_index(index_with_ids, index_path)
+        with sqlite3.connect(db_path) as conn:
+            set_state(conn, state_key(table, 'built_total'), len(ids))
+            set_state(conn, state_key(table, 'churn'), 0)
+            # 记下按哪种配置构建：数据太少无法训练时实际是 flat，下次不能因“类型不符”又全量重建
+            set_state(conn, state_key(table, 'index_type'), (config or {}).get('index_type', 'flat'))
+        print(f"索引生成完毕（{ann_index.index_kind(index_with_ids)}），包含 {len(ids)} 条数据，用时 {time.time() - t0:.1f}s。")
+
+    def load_embeddings(self, db_path, ids, table='documents'):
+        """按 id 分批读取向量，返回 (ids, vectors)"""
+        found_ids, blobs = [], []
+        with sqlite3.connect(db_path) as conn:
+            dtype = get_state(conn, 'embedding_dtype', 'float32')
+            for i in range(0, len(ids), 900):
+                chunk = [int(x) for x in ids[i:i+900]]
+                placeholders = ','.join(['?'] * len(chunk))
+                cursor = conn.execute(f"SELECT id, embedding FROM {table} WHERE id IN ({placeholders})", chunk)
+                for doc_id, blob in cursor:
+                    found_ids.append(doc_id)
+                    blobs.append(blob)
+        return np.array(found_ids, dtype='int64'), ann_index.decode_embeddings(blobs, dtype)
+
+    def ensure_embedding_dtype(self, db_path, dtype):
+        """
+        数据库里向量 BLOB 的存储格式（index_state.embedding_dtype，旧库为 float32）与配置不同时，
+        逐批转换 documents / chunks 的全部向量，完成后 VACUUM 回收空间
+        """
+        if dtype not in ann_index.EMBEDDING_DTYPES:
+            raise ValueError(f"未知向量存储格式: {dtype}")
+        with sqlite3.connect(db_path) as conn:
+            current = get_state(conn, 'embedding_dtype', 'float32')
+            if current == dtype:
+                return
+            print(f"转换向量存储格式 {current} -> {dtype} ...")
+            t0 = time.time()
+            for table in ('documents', 'chunks'):
+                last_id = 0
+                while True:
+                    rows = conn.execute(
+                        f"SELECT id, embedding FROM {table} WHERE id > ? ORDER BY id LIMIT 5000", (last_id,)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    vectors = ann_index.decode_embeddings([r[1] for r in rows], current)
+                    conn.executemany(
+                        f"UPDATE {table} SET embedding = ? WHERE id = ?",
+                        [(ann_index.encode_embedding(v, dtype), r[0]) for v, r in zip(vectors, rows)]
+                    )
+                    last_id = rows[-1][0]
+            # 与向量在同一事务里提交，中途失败不会留下格式混杂的库
+            conn.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES ('embedding_dtype', ?)", (dtype,))
+            conn.commit()
+            conn.execute("VACUUM")
+        print(f"转换完成，用时 {time.time() - t0:.1f}s。")
+
+    def check_consistency(self, db_path, index, table='documents'):
+        """
+        对比数据库与索引中的 id
+        返回: (missing, extra)，即库里有但索引缺少的 id、索引里有但库里已不存在的 id
+        """
+        with sqlite3.connect(db_path) as conn:
+            db_ids = np.array([row[0] for row in conn.execute(f"SELECT id FROM {table}")], dtype='int64')
+        index_ids = ann_index.index_ids(index)
+        return np.setdiff1d(db_ids, index_ids), np.setdiff1d(index_ids, db_ids)
+
+    def update_index(self, db_path, index_path, config, table='documents'):
+        """
+        增量更新索引：新增/变更的文档 add_with_ids，已删除的 remove_ids
+        （变更的文件经 INSERT OR REPLACE 后换了新 id，表现为删一条、加一条）。
+        以下情况改为全量重建：索引文件缺失或损坏、类型/维度与配置不符（数据太少退回 flat 的不算）、
+        HNSW 需要删除（不支持 remove_ids）、IVF/HNSW 累计变更超过 rebuild_ratio（重新训练聚类，即压缩）。
+        """
+        if not os.path.exists(index_path):
+            return self.export_index(db_path, index_path, config, table)
+        try:
+            index = faiss.read_index(index_path)
+        except Exception as e:
+            print(f"索引读取失败，全量重建: {e}")
+            return self.export_index(db_path, index_path, config, table)
+
+        kind = ann_index.index_kind(index)
+        want = config.get('index_type', 'flat')
+        with sqlite3.connect(db_path) as conn:
+            built_for = get_state(conn, state_key(table, 'index_type'), kind)
+        # 按当前配置构建、只因数据太少退回 flat 的索引照常增量更新
+        if kind != want and built_for != want:
+            print(f"索引类型 {kind} 与配置 {want} 不符，全量重建")
+            return self.export_index(db_path, index_path, config, table)
+        if not ann_index.supports_incremental(index):
+            # 旧版本把 IVF 套在 IndexIDMap 里，增删后 id 会错乱，重建成不带包装的 IVF
+            print(f"索引格式不支持增量更新（{kind}），全量重建")
+            return self.export_index(db_path, index_path, config, table)
+
+        missing, extra = self.check_consistency(db_path, index, table)
+        if not len(missing) and not len(extra):
+            print(f"索引与数据库一致（{index.ntotal} 条），无需更新。")
+            return
+
+        if len(extra) and kind == 'hnsw':
+            print(f"HNSW 不支持删除（待删 {len(extra)} 条），全量重建")
+            return self.export_index(db_path, index_path, config, table)
+
+        rebuild_ratio = config.get('rebuild_ratio', 0.2)
+        with sqlite3.connect(db_path) as conn:
+            built_total = int(get_state(conn, state_key(table, 'built_total'), index.ntotal))
+            churn = int(get_state(conn, state_key(table, 'churn'), 0)) + len(missing) + len(extra)
+        # 退回 flat 的索引同样按累计变更重建，数据攒够后就能训练成配置的类型
+        if (kind != 'flat' or kind != want) and churn > rebuild_ratio * max(built_total, 1):
+            print(f"累计变更 {churn} 条，超过上次构建规模 {built_total} 的 {rebuild_ratio:.0%}，全量重建")
+            return self.export_index(db_path, index_path, config, table)
+
+        t0 = time.time()
+        ids, vectors = self.load_embeddings(db_path, missing, table)
+        if len(ids) and vectors.shape[1] != index.d:
+            print(f"向量维度 {vectors.shape[1]} 与索引 {index.d} 不符，全量重建")
+            return self.export_index(db_path, index_path, config, table)
+
+        if len(extra):
+            index.remove_ids(faiss.IDSelectorBatch(extra))
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        ann_index.write_index(index, index_path)
+        with sqlite3.connect(db_path) as conn:
+            set_state(conn, state_key(table, 'churn'), churn)
+        print(f"索引增量更新（{kind}）：+{len(ids)} -{len(extra)}，共 {index.ntotal} 条，用时 {time.time() - t0:.1f}s。")
+
+
+def state_key(table, name):
+    # documents 沿用原来的键名，其他表加前缀
+    return name if table == 'documents' else f"{table}.{name}"
+
+
+def get_state(conn, key, default=None):
+    row = conn.execute("SELECT value FROM index_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_state(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES (?, ?)", (key, str(value)))
+    conn.commit()
 
 # --- 主程序入口 ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="扫描目录并更新语义搜索索引")
+    parser.add_argument('--rebuild', action='store_true', help='全量重建所有索引（默认增量更新）')
+    args = parser.parse_args()
+
     indexer = FileIndexer(MODEL_NAME)
     
     # 依次处理配置文件中的每个任务
     for config in CONFIG_LIST:
         try:
-            indexer.run_config(config)
+            indexer.run_config(config, rebuild=args.rebuild)
         except Exception as e:
             print(f"任务 {config['name']} 处理出错: {e}")
             import traceback
@@ -0,0 +1,105 @@
+"""
+查询向量编码：LRU 缓存 + 微批处理（app.py 使用）
+
+- 相同查询（翻页、重复搜索）直接命中缓存，不再跑模型
+- 并发请求的未命中查询由后台线程在 max_wait_ms 内攒成一批，一次 encode 完成
+- 同一查询正在编码时，后来的请求等待同一个结果，不重复编码
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+QUERY_CACHE_SIZE = 2048  # 缓存的查询向量条数（512 维 float32 约 2KB/条）
+MAX_BATCH = 32
+MAX_WAIT_MS = 5
+
+
+class QueryEncoder:
+    def __init__(self, model, cache_size=QUERY_CACHE_SIZE, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.model = model
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._cache = OrderedDict()
+        self._pending = {}  # 正在编码的查询 -> Future
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.encoded = 0
+        self._thread = threading.Thread(target=self._run, name='query-encoder', daemon=True)
+        self._thread.start()
+
+    def encode(self, query):
+        """返回形状为 (1, d) 的归一化 float32 向量"""
+        with self._lock:
+            vec = self._cache.get(query)
+            if vec is not None:
+                self._cache.move_to_end(query)
+                self.hits += 1
+                return vec
+            self.misses += 1
+            future = self._pending.get(query)
+            if future is None:
+                future = Future()
+                self._pending[query] = future
+                self._queue.put((query, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch):
+        queries = [q for q, _ in batch]
+        try:
+            vectors = np.asarray(self.model.encode(queries, normalize_embeddings=True), dtype=np.float32)
+        except Exception as e:
+            with self._lock:
+                for q, future in batch:
+                    self._pending.pop(q, None)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        vecs = []
+        for i in range(len(batch)):
+            vec = vectors[i:i + 1]
+            vec.setflags(write=False)  # 缓存里的向量被多个请求共享，禁止原地修改
+            vecs.append(vec)
+        with self._lock:
+            self.batches += 1
+            self.encoded += len(batch)
+            for (q, _), vec in zip(batch, vecs):
+                self._cache[q] = vec
+                self._pending.pop(q, None)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for (_, future), vec in zip(batch, vecs):
+            future.set_result(vec)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "batches": self.batches,
+                "avg_batch": self.encoded / self.batches if self.batches else 0.0,
+            }